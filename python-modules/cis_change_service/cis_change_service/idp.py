@@ -1,12 +1,13 @@
-import json
 import logging
 
 from functools import wraps
 from flask import request
 from flask import _request_ctx_stack
-from six.moves.urllib.request import urlopen
 from jose import jwt
 
+from cis_crypto.jwks import JWKSCache
+from cis_crypto.jwks import TokenCache
+
 from cis_change_service.common import get_config
 from cis_change_service.exceptions import AuthError
 
@@ -18,6 +19,10 @@ AUTH0_DOMAIN = CONFIG("auth0_domain", namespace="change_service", default="auth-
 API_IDENTIFIER = CONFIG("api_identifier", namespace="change_service", default="https://change.sso.allizom.org")
 ALGORITHMS = CONFIG("algorithms", namespace="change_service", default="RS256")
 
+# Shared by all requests of this process, see cis_crypto.jwks
+jwks_cache = JWKSCache("https://{}/.well-known/jwks.json".format(AUTH0_DOMAIN))
+token_cache = TokenCache()
+
 
 # Format error response and append status code
 def get_token_auth_header():
@@ -44,11 +49,21 @@ def get_token_auth_header():
     return token
 
 
-def get_jwks():
-    # XXX TBD do this with request purely instead of six
-    jsonurl = urlopen("https://" + AUTH0_DOMAIN + "/.well-known/jwks.json")
-    jwks = json.loads(jsonurl.read())
-    return jwks
+def get_jwks(refresh=False):
+    """
+    Returns the JWKS of our identity provider, from the in-process cache
+    @refresh bool fetch it again, e.g. because the token was signed with a key we do not know yet (rate limited)
+    """
+    if refresh:
+        return jwks_cache.refresh()
+    return jwks_cache.get()
+
+
+def get_rsa_key(jwks, kid):
+    for key in jwks["keys"]:
+        if key["kid"] == kid:
+            return {"kty": key["kty"], "kid": key["kid"], "use": key["use"], "n": key["n"], "e": key["e"]}
+    return {}
 
 
 def requires_auth(f):
@@ -65,12 +80,17 @@ def requires_auth(f):
             return f(*args, **kwargs)
         else:
             token = get_token_auth_header()
-            jwks = get_jwks()
+            payload = token_cache.get(token)
+            if payload is not None:
+                logger.debug("The auth token was already verified.")
+                _request_ctx_stack.top.current_user = payload
+                return f(*args, **kwargs)
+
             unverified_header = jwt.get_unverified_header(token)
-            rsa_key = {}
-            for key in jwks["keys"]:
-                if key["kid"] == unverified_header["kid"]:
-                    rsa_key = {"kty": key["kty"], "kid": key["kid"], "use": key["use"], "n": key["n"], "e": key["e"]}
+            rsa_key = get_rsa_key(get_jwks(), unverified_header["kid"])
+            if not rsa_key:
+                # The keys may have been rotated since we cached them
+                rsa_key = get_rsa_key(get_jwks(refresh=True), unverified_header["kid"])
             if rsa_key:
                 try:
                     logger.debug(token)
@@ -99,6 +119,7 @@ def requires_auth(f):
                         {"code": "invalid_header", "description": "Unable to parse authentication" " token."}, 401
                     )
 
+                token_cache.set(token, payload)
                 _request_ctx_stack.top.current_user = payload
                 return f(*args, **kwargs)
             raise AuthError({"code": "invalid_header", "description": "Unable to find appropriate key"}, 401)
@@ -8,6 +8,7 @@ from botocore.exceptions import ClientError
 from cis_aws import connect
 from cis_change_service import common
 from cis_identity_vault.models import user
+from cis_identity_vault.profile_views import DEFAULT_VIEWS
 from cis_profile.profile import User
 from cis_change_service.exceptions import IntegrationError
 from cis_change_service.exceptions import VerificationError
@@ -92,7 +93,24 @@ class Vault(object):
 
         return user
 
-    def _search_and_merge(self, user_id, cis_profile_object):
+    def _find_in_vault(self, user_ids):
+        """
+        Fetch the vault records of many users in a few round trips
+        @user_ids list of str user_ids
+
+        Returns a dict of user_id: vault record, for the users that exist in the vault
+        """
+        try:
+            self._connect()
+            vault = user.Profile(self.identity_vault_client.get("table"), self.identity_vault_client.get("client"))
+            vault_records = vault.find_by_ids(user_ids)
+            logger.info("Search users in vault results: {} of {}".format(len(vault_records), len(user_ids)))
+        except Exception as e:
+            logger.critical("Problem finding user profiles in identity vault due to: {}".format(e))
+            raise (e)
+        return vault_records
+
+    def _search_and_merge(self, user_id, cis_profile_object, vault_records=None):
         """
         Search for an existing user in the vault for the given profile
         If one exist, merge the given profile with the existing user
@@ -103,21 +121,15 @@ class Vault(object):
 
         @cis_profile_object cis_profile.User object of an incoming user
         @user_id str the user id of cis_profile_object
+        @vault_records dict of user_id: vault record as returned by _find_in_vault(). Looked up when None.
 
         Returns a cis_profile.User object
         """
 
-        try:
-            self._connect()
-            vault = user.Profile(self.identity_vault_client.get("table"), self.identity_vault_client.get("client"))
-            res = vault.find_by_id(user_id)
-            logger.info("Search user in vault results: {}".format(len(res["Items"])))
-
-        except Exception as e:
-            logger.critical("Problem finding user profile in identity vault due to: {}".format(e))
-            raise (e)
+        if vault_records is None:
+            vault_records = self._find_in_vault([user_id])
 
-        if len(res["Items"]) > 0:
+        if user_id in vault_records:
             # This profile exists in the vault and will be merged and it's publishers verified
             self.condition = "update"
             logger.info(
@@ -125,7 +137,7 @@ class Vault(object):
                 extra={"user_id": user_id},
             )
 
-            old_user_profile = User(user_structure_json=json.loads(res["Items"][0]["profile"]))
+            old_user_profile = User(user_structure_json=json.loads(vault_records[user_id]["profile"]))
             new_user_profile = copy.deepcopy(old_user_profile)
             difference = new_user_profile.merge(cis_profile_object)
 
@@ -278,6 +290,8 @@ class Vault(object):
 
         # User profiles that have been verified, validated, merged, etc.
         profiles_to_store = []
+        # (user_id, cis_profile.User) for every incoming profile
+        incoming = []
 
         for user_profile in profiles:
             # Ensure we always have a cis_profile.User at this point (compat)
@@ -301,11 +315,17 @@ class Vault(object):
 
             else:
                 user_id = user_profile.user_id.value
+            incoming.append((user_id, user_profile))
+
+        # Look up all the existing users at once, the result is used both to merge and to pick creates vs updates
+        vault_records = self._find_in_vault([user_id for user_id, _ in incoming])
+
+        for user_id, user_profile in incoming:
             logger.info("Attempting integration of profile data into the vault", extra={"user_id": user_id})
 
             # Ensure we merge user_profile data when we have an existing user in the vault
             # This also does publisher verification
-            current_user = self._search_and_merge(user_id, user_profile)
+            current_user = self._search_and_merge(user_id, user_profile, vault_records)
             # No difference found, no merging occured, skip!
             if current_user is None:
                 logger.info(
@@ -343,14 +363,15 @@ class Vault(object):
 
         # Store resulting user in the vault
         logger.info("Will store {} verified profiles".format(len(profiles_to_store)))
-        return self._store_in_vault(profiles_to_store)
+        return self._store_in_vault(profiles_to_store, existing_ids=vault_records)
 
-    def _store_in_vault(self, profiles):
+    def _store_in_vault(self, profiles, existing_ids=None):
         """
         Actually store profiles in the vault
         All profiles must have been merged and verified correctly before calling this method
 
         @profiles list of cis_profiles.User
+        @existing_ids collection of the user_ids already in the vault (looked up again when None)
 
         Returns dict {"creates": result_of_users_created, "updates": result_of_users_updates}
         """
@@ -361,10 +382,18 @@ class Vault(object):
         try:
             self._connect()
 
+            if self.config("store_profile_views", namespace="cis", default="false") == "true":
+                views = DEFAULT_VIEWS
+            else:
+                views = None
+
             if self.config("dynamodb_transactions", namespace="cis") == "true":
                 logger.debug("Attempting to put batch of profiles ({}) using transactions.".format(len(profiles)))
                 vault = user.Profile(
-                    self.identity_vault_client.get("table"), self.identity_vault_client.get("client"), transactions=True
+                    self.identity_vault_client.get("table"),
+                    self.identity_vault_client.get("client"),
+                    transactions=True,
+                    views=views,
                 )
             else:
                 logger.debug(
@@ -374,6 +403,7 @@ class Vault(object):
                     self.identity_vault_client.get("table"),
                     self.identity_vault_client.get("client"),
                     transactions=False,
+                    views=views,
                 )
 
             # transform cis_profiles.User profiles to vault profiles
@@ -388,7 +418,7 @@ class Vault(object):
                 )
                 vault_profiles.append(vault_profile)
 
-            result = vault.find_or_create_batch(vault_profiles)
+            result = vault.find_or_create_batch(vault_profiles, existing_ids=existing_ids)
         except ClientError as e:
             logger.error(
                 "An error occured writing these profiles to dynamodb",
@@ -0,0 +1,139 @@
+"""In-process caches for the JSON Web Key Set of an identity provider, and for the access tokens it issued."""
+import hashlib
+import logging
+import requests
+import threading
+import time
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+
+class JWKSCache(object):
+    """
+    Keeps the JWKS of an identity provider in memory.
+
+    - A fresh JWKS (younger than `ttl`) is returned as is.
+    - A stale JWKS (up to `ttl + stale_ttl` old) is returned right away while a background thread fetches a new one.
+    - Past that, or on first use, the JWKS is fetched before returning.
+    - refresh() forces a fetch, e.g. when a token uses a kid we do not know yet (key rotation). Forced fetches happen
+      at most once per `min_refresh_interval` so that made up kids cannot be used to hammer the identity provider.
+
+    Usage:
+    ```
+    cache = JWKSCache("https://auth.mozilla.auth0.com/.well-known/jwks.json")
+    key = cache.get_key(unverified_header["kid"])
+    ```
+    """
+
+    def __init__(self, jwks_url, ttl=3600, stale_ttl=86400, min_refresh_interval=60, timeout=10):
+        self.jwks_url = jwks_url
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self._jwks = None
+        self._fetched_at = 0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def _fetch(self):
+        logger.debug("Fetching JWKS from {}".format(self.jwks_url))
+        response = requests.get(self.jwks_url, timeout=self.timeout)
+        response.raise_for_status()
+        jwks = response.json()
+        with self._lock:
+            self._jwks = jwks
+            self._fetched_at = time.time()
+        return jwks
+
+    def _background_fetch(self):
+        try:
+            self._fetch()
+        except Exception as e:
+            logger.warning("Could not refresh JWKS from {}, keeping the stale one: {}".format(self.jwks_url, e))
+        finally:
+            self._refreshing = False
+
+    def get(self):
+        """Returns the JWKS (dict with a `keys` list)"""
+        age = time.time() - self._fetched_at
+        if self._jwks is None or age > self.ttl + self.stale_ttl:
+            return self._fetch()
+
+        jwks = self._jwks
+        if age > self.ttl:
+            with self._lock:
+                start_refresh = not self._refreshing
+                self._refreshing = True
+            if start_refresh:
+                logger.debug("JWKS is stale, refreshing it in the background")
+                threading.Thread(target=self._background_fetch, daemon=True).start()
+        return jwks
+
+    def refresh(self):
+        """Fetch the JWKS now, unless it was fetched less than `min_refresh_interval` ago. Returns the JWKS."""
+        if self._jwks is not None and time.time() - self._fetched_at < self.min_refresh_interval:
+            logger.debug("JWKS was fetched recently, not refreshing it again")
+            return self._jwks
+        return self._fetch()
+
+    def _find_key(self, jwks, kid):
+        for key in jwks.get("keys", []):
+            if key.get("kid") == kid:
+                return key
+        return None
+
+    def get_key(self, kid):
+        """Returns the key with this kid, refreshing the JWKS once if it is unknown. None if it does not exist."""
+        key = self._find_key(self.get(), kid)
+        if key is None:
+            logger.info("Unknown kid {}, refreshing JWKS".format(kid))
+            key = self._find_key(self.refresh(), kid)
+        return key
+
+
+class TokenCache(object):
+    """
+    Remembers the claims of access tokens that were already verified, keyed by the sha256 of the token.
+    Entries are kept until the token expires (`exp` claim), for at most `max_ttl` seconds. Tokens without an `exp`
+    claim are never cached.
+    """
+
+    def __init__(self, max_size=1024, max_ttl=300):
+        self.max_size = max_size
+        self.max_ttl = max_ttl
+        self._tokens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, token):
+        if isinstance(token, str):
+            token = token.encode("utf-8")
+        return hashlib.sha256(token).digest()
+
+    def get(self, token):
+        """Returns the cached claims of this token, or None"""
+        key = self._key(token)
+        with self._lock:
+            entry = self._tokens.get(key)
+            if entry is None:
+                return None
+            expires, payload = entry
+            if expires <= time.time():
+                del self._tokens[key]
+                return None
+            self._tokens.move_to_end(key)
+            return payload
+
+    def set(self, token, payload):
+        """Remember the claims of a token that has been verified"""
+        if not isinstance(payload.get("exp"), (int, float)):
+            return
+        expires = min(payload["exp"], time.time() + self.max_ttl)
+        key = self._key(token)
+        with self._lock:
+            self._tokens[key] = (expires, payload)
+            self._tokens.move_to_end(key)
+            while len(self._tokens) > self.max_size:
+                self._tokens.popitem(last=False)
@@ -1,14 +1,38 @@
+import binascii
+import hashlib
 import json
 import logging
 import os
+import threading
 import yaml
+from collections import OrderedDict
 from jose import jwk
 from jose import jws
+from jose.exceptions import JWKError
 from jose.exceptions import JWSError
+from jose.utils import base64url_decode
+from jose.utils import base64url_encode
 from cis_crypto import secret
 from cis_crypto import common
 
 logger = logging.getLogger(__name__)
+
+# How many verified signatures are remembered by Verify.jws(). Re-verifying one of these skips the RSA operation.
+VERIFIED_CACHE_SIZE = int(common.get_config()("verified_signature_cache_size", namespace="cis", default="4096"))
+# How many different public key sets we keep constructed keys for (keys rotate rarely, this is plenty).
+KEY_CACHE_SIZE = 64
+
+# (secret manager, key directory, key name): jose key object. See Sign._get_key()
+_signing_keys = {}
+# Every jws we sign has this header, encoded exactly like jose.jws.sign() encodes it
+_RS256_HEADER = base64url_encode(
+    json.dumps({"alg": "RS256", "typ": "JWT"}, separators=(",", ":"), sort_keys=True).encode("utf-8")
+)
+# key set id: list of (kid, jose key object). See Verify._get_key_objects()
+_key_objects = {}
+# (key set id, sha256 of a jws): payload of the jws, in least recently used order
+_verified = OrderedDict()
+_cache_lock = threading.Lock()
 # Note:
 # These attrs on sign/verify could be refactored to use object inheritance.  Leaving as is for now for readability.
 
@@ -23,6 +47,11 @@ class Sign(object):
 
     def load(self, data):
         """Loads a payload to the object and ensures that the thing is serializable."""
+        if isinstance(data, dict):
+            # Already deserialized, no need to attempt YAML or JSON parsing
+            self.payload = data
+            return self.payload
+
         try:
             data = yaml.safe_load(data)
         except yaml.scanner.ScannerError:
@@ -44,13 +73,39 @@ class Sign(object):
         if keyname is not None:
             self.key_name = keyname
         key_jwk = self._get_key()
-        sig = jws.sign(self.payload, key_jwk.to_dict(), algorithm="RS256")
-        return sig
+        if not isinstance(self.payload, dict):
+            return jws.sign(self.payload, key_jwk.to_dict(), algorithm="RS256")
+
+        # Same output as jws.sign(), without having jose construct the RSA key again for every signature
+        payload = base64url_encode(json.dumps(self.payload, separators=(",", ":")).encode("utf-8"))
+        signing_input = b".".join([_RS256_HEADER, payload])
+        try:
+            signature = key_jwk.sign(signing_input)
+        except Exception as e:
+            raise JWSError(e)
+        return b".".join([signing_input, base64url_encode(signature)]).decode("utf-8")
+
+    def jws_many(self, payloads, keyname=None):
+        """
+        Sign many payloads with the same key
+        @payloads list of dict
+        Returns a list of jws, in the same order as @payloads
+        """
+        signatures = []
+        for payload in payloads:
+            self.load(payload)
+            signatures.append(self.jws(keyname))
+        return signatures
 
     def _get_key(self):
         if self._jwk is None:
-            manager = secret.Manager(provider_type=self.secret_manager)
-            self._jwk = manager.get_key(key_name=self.key_name)
+            key_dir = self.config("secret_manager_file_path", namespace="cis", default="")
+            cache_key = (self.secret_manager, key_dir, self.key_name)
+            self._jwk = _signing_keys.get(cache_key)
+            if self._jwk is None:
+                manager = secret.Manager(provider_type=self.secret_manager)
+                self._jwk = manager.get_key(key_name=self.key_name)
+                _signing_keys[cache_key] = self._jwk
         return self._jwk
 
 
@@ -68,18 +123,20 @@ class Verify(object):
         # Store the original form in the jws_signature attribute
         self.jws_signature = jws_signature
 
+    def _public_key_path(self):
+        key_dir = self.config(
+            "secret_manager_file_path",
+            namespace="cis",
+            default=("{}/.mozilla-iam/keys/".format(os.path.expanduser("~"))),
+        )
+        key_name = self.config("public_key_name", namespace="cis", default="access-file-key")
+        return os.path.join(key_dir, "{}".format(key_name))
+
     def _get_public_key(self, keyname=None):
         """Returns a jwk construct for the public key and mode specified."""
         if self.well_known_mode == "file":
-            key_dir = self.config(
-                "secret_manager_file_path",
-                namespace="cis",
-                default=("{}/.mozilla-iam/keys/".format(os.path.expanduser("~"))),
-            )
-            key_name = self.config("public_key_name", namespace="cis", default="access-file-key")
-            file_name = "{}".format(key_name)
-            fh = open((os.path.join(key_dir, file_name)), "rb")
-            key_content = fh.read()
+            with open(self._public_key_path(), "rb") as fh:
+                key_content = fh.read()
             key_construct = jwk.construct(key_content, "RS256")
             return [key_construct.to_dict()]
         elif self.well_known_mode == "http" or self.well_known_mode == "https":
@@ -101,33 +158,95 @@ class Verify(object):
             logger.debug("Publisher based verification, will use {} public keys for verification.".format(keys))
         return keys
 
+    def _get_key_objects(self, keyname=None):
+        """
+        Returns a tuple (key set id, list of (kid, jose key object)) for the mode and key name specified.
+        Keys are only read and constructed the first time a key set is seen, the key set id changes whenever the
+        key material does (key file modified, new well-known content).
+        """
+        if self.well_known_mode == "file":
+            path = self._public_key_path()
+            key_set = "file:{}:{}".format(path, os.stat(path).st_mtime)
+            key_material = None
+        elif self.well_known_mode == "http" or self.well_known_mode == "https":
+            key_material = self._reduce_keys(keyname)
+            if isinstance(key_material, dict):
+                key_material = [key_material]
+            fingerprint = hashlib.sha256(json.dumps(key_material, sort_keys=True).encode("utf-8")).hexdigest()
+            key_set = "jwks:{}".format(fingerprint)
+        else:
+            return (None, [])
+
+        key_objects = _key_objects.get(key_set)
+        if key_objects is not None:
+            return (key_set, key_objects)
+
+        if key_material is None:
+            key_material = self._get_public_key(keyname)
+
+        key_objects = []
+        for key in key_material:
+            kid = None
+            if isinstance(key, dict):
+                kid = key.get("kid")
+                key = {k: v for k, v in key.items() if k not in ["x5t", "x5c"]}
+            try:
+                key_objects.append((kid, jwk.construct(key, "RS256")))
+            except JWKError as e:
+                logger.error("Could not construct public key {}: {}".format(kid, e))
+
+        with _cache_lock:
+            if len(_key_objects) >= KEY_CACHE_SIZE:
+                _key_objects.clear()
+            _key_objects[key_set] = key_objects
+        return (key_set, key_objects)
+
     def jws(self, keyname=None):
         """Assumes you loaded a payload.  Return the same jws or raise a custom exception."""
-        key_material = self._get_public_key(keyname)
+        key_set, key_objects = self._get_key_objects(keyname)
 
-        logger.debug(
-            "The key material for the payload was loaded for: {}".format(keyname), extra={"key_material": key_material}
-        )
+        logger.debug("The key material for the payload was loaded for: {}".format(keyname), extra={"key_set": key_set})
 
-        if isinstance(key_material, list):
-            logger.debug("Multiple keys returned.  Attempting match.")
-            for key in key_material:
-                try:
-                    key.pop("x5t", None)
-                    key.pop("x5c", None)
-                except AttributeError:
-                    logger.warn("x5t and x5c attrs do not exist in key material.")
-
-                logger.debug("Attempting to match against: {}".format(key))
-                try:
-                    sig = jws.verify(self.jws_signature, key, algorithms="RS256", verify=True)
-                    logger.debug(
-                        "Matched a verified signature for: {}".format(key), extra={"signature": self.jws_signature}
-                    )
-                    return sig
-                except JWSError as e:
-                    logger.error(
-                        "The signature was not valid for the payload.", extra={"signature": self.jws_signature}
-                    )
-                    logger.error(e)
-        raise JWSError("The signature could not be verified for any trusted key", key_material)
+        token = self.jws_signature
+        if isinstance(token, str):
+            token = token.encode("utf-8")
+
+        cache_key = (key_set, hashlib.sha256(token).digest())
+        with _cache_lock:
+            payload = _verified.get(cache_key)
+            if payload is not None:
+                _verified.move_to_end(cache_key)
+                return payload
+
+        header = jws.get_unverified_header(token)
+        if header.get("alg") != "RS256":
+            raise JWSError("The specified alg value is not allowed")
+        try:
+            signing_input, crypto_segment = token.rsplit(b".", 1)
+            payload = base64url_decode(signing_input.split(b".", 1)[1])
+            signature = base64url_decode(crypto_segment)
+        except (TypeError, binascii.Error):
+            raise JWSError("Invalid payload or crypto padding")
+
+        # When the signature names its key, only try that one
+        candidates = [key for kid, key in key_objects if kid is not None and kid == header.get("kid")]
+        if len(candidates) == 0:
+            candidates = [key for kid, key in key_objects]
+
+        for key in candidates:
+            try:
+                verified = key.verify(signing_input, signature)
+            except Exception as e:
+                logger.debug("Could not verify the signature with key {}: {}".format(key, e))
+                verified = False
+            if verified:
+                logger.debug("Matched a verified signature", extra={"signature": self.jws_signature})
+                with _cache_lock:
+                    _verified[cache_key] = payload
+                    if len(_verified) > VERIFIED_CACHE_SIZE:
+                        _verified.popitem(last=False)
+                return payload
+            logger.debug("The signature was not valid for this key.", extra={"signature": self.jws_signature})
+
+        logger.error("The signature was not valid for the payload.", extra={"signature": self.jws_signature})
+        raise JWSError("The signature could not be verified for any trusted key", key_set)
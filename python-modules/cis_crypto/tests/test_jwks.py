@@ -0,0 +1,74 @@
+import time
+from unittest import mock
+
+
+class FakeResponse(object):
+    def __init__(self, jwks):
+        self.jwks = jwks
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.jwks
+
+
+class TestJWKS(object):
+    def test_jwks_is_cached(self):
+        from cis_crypto.jwks import JWKSCache
+
+        cache = JWKSCache("https://fake/.well-known/jwks.json")
+        with mock.patch("cis_crypto.jwks.requests.get") as get:
+            get.return_value = FakeResponse({"keys": [{"kid": "a"}]})
+            assert cache.get_key("a") == {"kid": "a"}
+            assert cache.get_key("a") == {"kid": "a"}
+            assert get.call_count == 1
+
+    def test_unknown_kid_refresh_is_rate_limited(self):
+        from cis_crypto.jwks import JWKSCache
+
+        cache = JWKSCache("https://fake/.well-known/jwks.json", min_refresh_interval=60)
+        with mock.patch("cis_crypto.jwks.requests.get") as get:
+            get.return_value = FakeResponse({"keys": [{"kid": "a"}]})
+            cache.get()
+            cache._fetched_at = time.time() - 120
+            get.return_value = FakeResponse({"keys": [{"kid": "a"}, {"kid": "rotated"}]})
+            # A new kid triggers a refresh
+            assert cache.get_key("rotated") == {"kid": "rotated"}
+            assert get.call_count == 2
+            # But made up kids do not trigger more than one refresh per interval
+            assert cache.get_key("made-up") is None
+            assert cache.get_key("made-up-again") is None
+            assert get.call_count == 2
+
+    def test_stale_jwks_is_served_while_refreshing(self):
+        from cis_crypto.jwks import JWKSCache
+
+        cache = JWKSCache("https://fake/.well-known/jwks.json", ttl=10)
+        with mock.patch("cis_crypto.jwks.requests.get") as get:
+            get.return_value = FakeResponse({"keys": [{"kid": "a"}]})
+            cache.get()
+            cache._fetched_at = time.time() - 20
+            get.return_value = FakeResponse({"keys": [{"kid": "b"}]})
+            assert cache.get() == {"keys": [{"kid": "a"}]}
+            for _ in range(0, 100):
+                if cache.get() == {"keys": [{"kid": "b"}]}:
+                    break
+                time.sleep(0.01)
+            assert cache.get() == {"keys": [{"kid": "b"}]}
+
+    def test_token_cache(self):
+        from cis_crypto.jwks import TokenCache
+
+        cache = TokenCache(max_size=2)
+        cache.set("token1", {"sub": "user1", "exp": time.time() + 60})
+        cache.set("expired", {"sub": "user2", "exp": time.time() - 1})
+        cache.set("no-exp", {"sub": "user3"})
+        assert cache.get("token1")["sub"] == "user1"
+        assert cache.get("expired") is None
+        assert cache.get("no-exp") is None
+        cache.set("token2", {"sub": "user2", "exp": time.time() + 60})
+        cache.set("token3", {"sub": "user3", "exp": time.time() + 60})
+        # token1 was evicted, only the 2 most recently used tokens are kept
+        assert cache.get("token1") is None
+        assert cache.get("token3")["sub"] == "user3"
@@ -236,3 +236,46 @@ class TestOperation(object):
         assert key_material is not None
         res = json.loads(o.jws(keyname="mozilliansorg"))
         assert isinstance(res, dict) is True
+
+    def test_verify_caches(self):
+        from cis_crypto import operation
+        from jose import jwk
+        from jose.exceptions import JWSError
+        from unittest import mock
+
+        os.environ["CIS_PUBLIC_KEY_NAME"] = "publisher"
+        with open("tests/fixture/fake-well-known.json") as fd:
+            fake_wk = json.loads(fd.read())
+
+        with open("tests/fixture/fake-publisher-key_0.priv.jwk") as fd:
+            fake_jwk_priv_jose = jwk.construct(json.loads(fd.read()), "RS256")
+
+        s = operation.Sign()
+        s.load({"metadata": {"classification": "PUBLIC"}, "value": "test_verify_caches"})
+        s._jwk = fake_jwk_priv_jose
+        signature = s.jws()
+
+        o = operation.Verify()
+        o.well_known_mode = "https"
+        o.well_known = fake_wk
+        o.load(signature)
+        first = o.jws(keyname="hris")
+        assert json.loads(first)["value"] == "test_verify_caches"
+
+        # The key objects are constructed once and the verified signature is remembered
+        with mock.patch("cis_crypto.operation.jwk.construct") as construct:
+            assert o.jws(keyname="hris") == first
+            assert construct.called is False
+
+        # Tampering with the signature must still fail, and failures are not remembered
+        o.load(signature[:-8] + "AAAAAAAA")
+        with pytest.raises(JWSError):
+            o.jws(keyname="hris")
+        with pytest.raises(JWSError):
+            o.jws(keyname="hris")
+
+        # The cache is keyed by key material: a publisher with other keys does not get the cached result
+        fake_wk["api"]["publishers_jwks"]["ldap"]["keys"] = []
+        o.load(signature)
+        with pytest.raises(JWSError):
+            o.jws(keyname="ldap")
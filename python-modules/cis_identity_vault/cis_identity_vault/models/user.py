@@ -11,6 +11,7 @@ user_profile must be passed to this in the form required by dynamodb
 """
 import json
 import logging
+import time
 import uuid
 from boto3.dynamodb.conditions import Attr
 from boto3.dynamodb.conditions import Key
@@ -29,19 +30,107 @@ from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.exc import NoResultFound
 
 from cis_identity_vault.parallel_dynamo import scan
+from cis_identity_vault.profile_views import render_views
 
 
 logger = logging.getLogger(__name__)
 
+# BatchGetItem accepts at most 100 keys per call.
+BATCH_GET_MAX_KEYS = 100
+# How many times we retry the keys dynamodb did not process (throttling, 16MB response limit) before giving up.
+BATCH_GET_MAX_ATTEMPTS = 5
+
 
 class Profile(object):
-    def __init__(self, dynamodb_table_resource=None, dynamodb_client=None, transactions=True):
-        """Take a dynamodb table resource to use for operations."""
+    def __init__(self, dynamodb_table_resource=None, dynamodb_client=None, transactions=True, views=None):
+        """
+        Take a dynamodb table resource to use for operations.
+        @views list of (classifications, display_levels) filtered views to store along with each profile written, see
+        cis_identity_vault.profile_views. None (default) stores no views.
+        """
         self.table = dynamodb_table_resource
         self.client = dynamodb_client
         self.transactions = transactions
+        self.views = views
         self.deserializer = TypeDeserializer()
 
+    def _item(self, user_profile, cis_profile_user_object):
+        """Item for table.put_item() / batch.put_item()"""
+        item = {
+            "id": user_profile["id"],
+            "user_uuid": user_profile["user_uuid"],
+            "profile": user_profile["profile"],
+            "primary_email": user_profile["primary_email"],
+            "primary_username": user_profile["primary_username"],
+            "sequence_number": user_profile["sequence_number"],
+            "active": bool(json.loads(user_profile["profile"])["active"]["value"]),
+            "flat_profile": {
+                k: self.deserializer.deserialize(v) for k, v in cis_profile_user_object.as_dynamo_flat_dict().items()
+            },
+        }
+        if self.views:
+            item["profile_views"] = render_views(user_profile["profile"], self.views)
+        return item
+
+    def _put_transact_item(self, user_profile, cis_profile_user_object):
+        """Put operation for _run_transaction()"""
+        item = {
+            "id": {"S": user_profile["id"]},
+            "user_uuid": {"S": user_profile["user_uuid"]},
+            "profile": {"S": user_profile["profile"]},
+            "primary_email": {"S": user_profile["primary_email"]},
+            "primary_username": {"S": user_profile["primary_username"]},
+            "sequence_number": {"S": user_profile["sequence_number"]},
+            "active": {"BOOL": json.loads(user_profile["profile"])["active"]["value"]},
+            "flat_profile": {"M": cis_profile_user_object.as_dynamo_flat_dict()},
+        }
+        if self.views:
+            item["profile_views"] = {
+                "M": {key: {"S": view} for key, view in render_views(user_profile["profile"], self.views).items()}
+            }
+        return {
+            "Put": {
+                "Item": item,
+                "ConditionExpression": "attribute_not_exists(id)",
+                "TableName": self.table.name,
+                "ReturnValuesOnConditionCheckFailure": "NONE",
+            }
+        }
+
+    def _update_transact_item(self, user_profile, cis_profile_user_object):
+        """Update operation for _run_transaction()"""
+        attribute_values = {
+            ":p": {"S": user_profile["profile"]},
+            ":u": {"S": user_profile["user_uuid"]},
+            ":pe": {"S": user_profile["primary_email"]},
+            ":pn": {"S": user_profile["primary_username"]},
+            ":sn": {"S": user_profile["sequence_number"]},
+            ":a": {"BOOL": json.loads(user_profile["profile"])["active"]["value"]},
+            ":fp": {"M": cis_profile_user_object.as_dynamo_flat_dict()},
+        }
+        update_expression = (
+            "SET profile = :p, primary_email = :pe, sequence_number = :sn, user_uuid = :u, "
+            "primary_username = :pn, active = :a, flat_profile = :fp"
+        )
+        if self.views:
+            attribute_values[":v"] = {
+                "M": {key: {"S": view} for key, view in render_views(user_profile["profile"], self.views).items()}
+            }
+            update_expression = update_expression + ", profile_views = :v"
+        else:
+            # Views of the previous version of the profile must not outlive it
+            update_expression = update_expression + " REMOVE profile_views"
+        return {
+            "Update": {
+                "Key": {"id": {"S": user_profile["id"]}},
+                "ExpressionAttributeValues": attribute_values,
+                "ConditionExpression": "attribute_exists(id)",
+                "UpdateExpression": update_expression,
+                "TableName": self.table.name,
+                "ReturnValuesOnConditionCheckFailure": "NONE",
+            }
+        }
+
     def _run_transaction(self, transact_items):
         sequence_numbers = []
         for t in transact_items:
@@ -78,21 +167,7 @@ class Profile(object):
 
         cis_profile_user_object = User(user_structure_json=json.loads(user_profile["profile"]))
 
-        return self.table.put_item(
-            Item={
-                "id": user_profile["id"],
-                "user_uuid": user_profile["user_uuid"],
-                "profile": user_profile["profile"],
-                "primary_email": user_profile["primary_email"],
-                "primary_username": user_profile["primary_username"],
-                "sequence_number": user_profile["sequence_number"],
-                "active": bool(json.loads(user_profile["profile"])["active"]["value"]),
-                "flat_profile": {
-                    k: self.deserializer.deserialize(v)
-                    for k, v in cis_profile_user_object.as_dynamo_flat_dict().items()
-                },
-            }
-        )
+        return self.table.put_item(Item=self._item(user_profile, cis_profile_user_object))
 
     def _create_with_transaction(self, user_profile):
         if user_profile["sequence_number"] is None:
@@ -100,23 +175,7 @@ class Profile(object):
 
         cis_profile_user_object = User(user_structure_json=json.loads(user_profile["profile"]))
 
-        transact_items = {
-            "Put": {
-                "Item": {
-                    "id": {"S": user_profile["id"]},
-                    "user_uuid": {"S": user_profile["user_uuid"]},
-                    "profile": {"S": user_profile["profile"]},
-                    "primary_email": {"S": user_profile["primary_email"]},
-                    "primary_username": {"S": user_profile["primary_username"]},
-                    "sequence_number": {"S": user_profile["sequence_number"]},
-                    "active": {"BOOL": json.loads(user_profile["profile"])["active"]["value"]},
-                    "flat_profile": {"M": cis_profile_user_object.as_dynamo_flat_dict()},
-                },
-                "ConditionExpression": "attribute_not_exists(id)",
-                "TableName": self.table.name,
-                "ReturnValuesOnConditionCheckFailure": "NONE",
-            }
-        }
+        transact_items = self._put_transact_item(user_profile, cis_profile_user_object)
         return self._run_transaction([transact_items])
 
     def update(self, user_profile):
@@ -128,45 +187,13 @@ class Profile(object):
 
     def _update_with_transaction(self, user_profile):
         cis_profile_user_object = User(user_structure_json=json.loads(user_profile["profile"]))
-        transact_items = {
-            "Update": {
-                "Key": {"id": {"S": user_profile["id"]}},
-                "ExpressionAttributeValues": {
-                    ":p": {"S": user_profile["profile"]},
-                    ":u": {"S": user_profile["user_uuid"]},
-                    ":pe": {"S": user_profile["primary_email"]},
-                    ":pn": {"S": user_profile["primary_username"]},
-                    ":sn": {"S": user_profile["sequence_number"]},
-                    ":a": {"BOOL": json.loads(user_profile["profile"])["active"]["value"]},
-                    ":fp": {"M": cis_profile_user_object.as_dynamo_flat_dict()},
-                },
-                "ConditionExpression": "attribute_exists(id)",
-                "UpdateExpression": "SET profile = :p, primary_email = :pe, sequence_number = :sn, user_uuid = :u,"
-                "primary_username = :pn, active = :a, flat_profile = :fp",
-                "TableName": self.table.name,
-                "ReturnValuesOnConditionCheckFailure": "NONE",
-            }
-        }
+        transact_items = self._update_transact_item(user_profile, cis_profile_user_object)
         return self._run_transaction([transact_items])
 
     def _update_without_transaction(self, user_profile):
         cis_profile_user_object = User(user_structure_json=json.loads(user_profile["profile"]))
 
-        return self.table.put_item(
-            Item={
-                "id": user_profile["id"],
-                "user_uuid": user_profile["user_uuid"],
-                "profile": user_profile["profile"],
-                "primary_email": user_profile["primary_email"],
-                "primary_username": user_profile["primary_username"],
-                "sequence_number": user_profile["sequence_number"],
-                "active": bool(json.loads(user_profile["profile"])["active"]["value"]),
-                "flat_profile": {
-                    k: self.deserializer.deserialize(v)
-                    for k, v in cis_profile_user_object.as_dynamo_flat_dict().items()
-                },
-            }
-        )
+        return self.table.put_item(Item=self._item(user_profile, cis_profile_user_object))
 
     def delete(self, user_profile):
         res = self._delete_without_transaction(user_profile)
@@ -200,21 +227,7 @@ class Profile(object):
             for profile in list_of_profiles:
                 cis_profile_user_object = User(user_structure_json=json.loads(profile["profile"]))
 
-                batch.put_item(
-                    Item={
-                        "id": profile["id"],
-                        "user_uuid": profile["user_uuid"],
-                        "profile": profile["profile"],
-                        "primary_email": profile["primary_email"],
-                        "primary_username": profile["primary_username"],
-                        "sequence_number": profile["sequence_number"],
-                        "active": bool(json.loads(profile["profile"])["active"]["value"]),
-                        "flat_profile": {
-                            k: self.deserializer.deserialize(v)
-                            for k, v in cis_profile_user_object.as_dynamo_flat_dict().items()
-                        },
-                    }
-                )
+                batch.put_item(Item=self._item(profile, cis_profile_user_object))
                 sequence_numbers.append(profile["sequence_number"])
 
         return {"status": "200", "ResponseMetadata": {"HTTPStatusCode": 200}, "sequence_numbers": sequence_numbers}
@@ -227,23 +240,7 @@ class Profile(object):
 
             # XXX TBD cover this with tests.  Currently dynalite does not support tests for transactions.
             cis_profile_user_object = User(user_structure_json=json.loads(user_profile["profile"]))
-            transact_item = {
-                "Put": {
-                    "Item": {
-                        "id": {"S": user_profile["id"]},
-                        "user_uuid": {"S": user_profile["user_uuid"]},
-                        "profile": {"S": user_profile["profile"]},
-                        "primary_email": {"S": user_profile["primary_email"]},
-                        "primary_username": {"S": user_profile["primary_username"]},
-                        "sequence_number": {"S": user_profile["sequence_number"]},
-                        "active": {"BOOL": json.loads(user_profile["profile"])["active"]["value"]},
-                        "flat_profile": {"M": cis_profile_user_object.as_dynamo_flat_dict()},
-                    },
-                    "ConditionExpression": "attribute_not_exists(id)",
-                    "TableName": self.table.name,
-                    "ReturnValuesOnConditionCheckFailure": "NONE",
-                }
-            }
+            transact_item = self._put_transact_item(user_profile, cis_profile_user_object)
             transact_items.append(transact_item)
         logger.debug("Attempting to create batch of transactions for: {}".format(transact_items))
         return self._run_transaction(transact_items)
@@ -259,27 +256,7 @@ class Profile(object):
         transact_items = []
         for user_profile in list_of_profiles:
             cis_profile_user_object = User(user_structure_json=json.loads(user_profile["profile"]))
-            update_expression = "SET profile = :p, primary_email = :pe, \
-                sequence_number = :sn, user_uuid = :u, primary_username = :pn, \
-                active = :a, flat_profile = :fp"
-            transact_item = {
-                "Update": {
-                    "Key": {"id": {"S": user_profile["id"]}},
-                    "ExpressionAttributeValues": {
-                        ":p": {"S": user_profile["profile"]},
-                        ":u": {"S": user_profile["user_uuid"]},
-                        ":pe": {"S": user_profile["primary_email"]},
-                        ":pn": {"S": user_profile["primary_username"]},
-                        ":sn": {"S": user_profile["sequence_number"]},
-                        ":a": {"BOOL": json.loads(user_profile["profile"])["active"]["value"]},
-                        ":fp": {"M": cis_profile_user_object.as_dynamo_flat_dict()},
-                    },
-                    "ConditionExpression": "attribute_exists(id)",
-                    "UpdateExpression": update_expression,
-                    "TableName": self.table.name,
-                    "ReturnValuesOnConditionCheckFailure": "NONE",
-                }
-            }
+            transact_item = self._update_transact_item(user_profile, cis_profile_user_object)
             transact_items.append(transact_item)
         logger.debug("Attempting to update batch of transactions for: {}".format(transact_items))
         return self._run_transaction(transact_items)
@@ -288,6 +265,42 @@ class Profile(object):
         result = self.table.query(KeyConditionExpression=Key("id").eq(id))
         return result
 
+    def find_by_ids(self, ids):
+        """
+        Fetch many profiles at once with BatchGetItem, in chunks of BATCH_GET_MAX_KEYS
+        @ids list of str user_ids. Duplicates are fetched once.
+
+        Returns a dict of user_id: item for the users that exist in the vault. Items are in the same format as the ones
+        returned by find_by_id()
+        """
+        unique_ids = list(dict.fromkeys(ids))
+        found = {}
+
+        for chunk_start in range(0, len(unique_ids), BATCH_GET_MAX_KEYS):
+            chunk = unique_ids[chunk_start : chunk_start + BATCH_GET_MAX_KEYS]
+            request_items = {self.table.name: {"Keys": [{"id": user_id} for user_id in chunk]}}
+            attempt = 0
+
+            while request_items:
+                if attempt >= BATCH_GET_MAX_ATTEMPTS:
+                    raise ValueError(
+                        "Could not fetch all profiles from the vault",
+                        len(request_items[self.table.name]["Keys"]),
+                    )
+                if attempt > 0:
+                    logger.debug("Retrying {} unprocessed keys.".format(len(request_items[self.table.name]["Keys"])))
+                    time.sleep(0.05 * (2 ** attempt))
+
+                # The client of the table resource (de)serializes attribute values, like the table itself does.
+                response = self.table.meta.client.batch_get_item(RequestItems=request_items)
+                for item in response.get("Responses", {}).get(self.table.name, []):
+                    found[item["id"]] = item
+                request_items = response.get("UnprocessedKeys")
+                attempt = attempt + 1
+
+        logger.debug("Found {} of the {} profiles requested in the vault.".format(len(found), len(unique_ids)))
+        return found
+
     def find_by_email(self, primary_email):
         result = self.table.query(
             IndexName="{}-primary_email".format(self.table.table_name),
@@ -317,24 +330,15 @@ class Profile(object):
             users.extend(response["Items"])
         return users
 
-    def _last_evaluated_to_friendly(self, last_evaluated_key):
-        if last_evaluated_key is None:
-            return None
-        else:
-            return last_evaluated_key["id"]["S"]
-
-    def _next_page_to_dynamodb(self, next_page):
-        if next_page is not None:
-            return {"id": {"S": next_page}}
-
-    def all_filtered(self, connection_method=None, active=None, next_page=None):
+    def all_filtered(self, connection_method=None, active=None, next_page=None, max_pages_per_segment=None):
         """
         @query_filter str login_method
-        Returns a dict of all users filtered by query_filter
+        @next_page str opaque cursor returned as nextPage by a previous call
+        @max_pages_per_segment int bound the number of pages read per segment of the scan (None to read everything)
+        Returns a dict of all users filtered by query_filter and the nextPage cursor (None once all users were returned)
         """
 
         projection_expression = "id, primary_email, user_uuid, active"
-        next_page = self._next_page_to_dynamodb(next_page)
 
         if connection_method:
             logger.debug("No active filter passed.  Assuming we need all users.")
@@ -352,9 +356,10 @@ class Profile(object):
             filter_expression=filter_expression,
             expression_attr=expression_attr,
             projection_expression=projection_expression,
-            exclusive_start_key=next_page,
+            next_page=next_page,
+            max_pages_per_segment=max_pages_per_segment,
         )
-        return dict(users=response["users"], nextPage=self._last_evaluated_to_friendly(response.get("nextPage")))
+        return dict(users=response["users"], nextPage=response["nextPage"])
 
     def find_or_create(self, user_profile):
         profilev2 = json.loads(user_profile["profile"])
@@ -366,16 +371,24 @@ class Profile(object):
             logger.info("A user profile does not exist for: {}".format(profilev2["user_id"]["value"]))
         return res
 
-    def find_or_create_batch(self, user_profiles):
+    def find_or_create_batch(self, user_profiles, existing_ids=None):
+        """
+        Create or update a batch of vault profiles
+        @user_profiles list of vault profiles (dicts, see this module's docstring)
+        @existing_ids collection of the user_ids already in the vault, if the caller looked them up already. When None,
+        they are fetched with find_by_ids()
+        """
         updates = []
         creations = []
+        if existing_ids is None:
+            existing_ids = self.find_by_ids([user_profile["id"] for user_profile in user_profiles])
+
         for user_profile in user_profiles:
-            profilev2 = json.loads(user_profile["profile"])
-            if len(self.find_by_id(profilev2["user_id"]["value"])["Items"]) > 0:
-                logger.debug("Adding profile to the list of updates to perform: {}".format(profilev2))
+            if user_profile["id"] in existing_ids:
+                logger.debug("Adding profile to the list of updates to perform: {}".format(user_profile["id"]))
                 updates.append(user_profile)
             else:
-                logger.debug("Adding profile to the list of creations to perform: {}".format(profilev2))
+                logger.debug("Adding profile to the list of creations to perform: {}".format(user_profile["id"]))
                 creations.append(user_profile)
 
         try:
@@ -1,103 +1,239 @@
-"""Centralize logic for parallelism of scanning ops."""
-import queue
+"""Centralize logic for parallelism of scanning ops.
+
+Segments of a parallel scan are run on a single, process wide worker pool instead of one thread per segment and
+per request. Every task on the pool fetches exactly one page of one segment, so a request with many segments cannot
+starve the other requests sharing the pool, and pages are handed back to the caller as soon as they arrive.
+"""
+import base64
+import json
+import math
 import threading
+import time
+import zlib
 
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 from logging import getLogger
 
+from cis_identity_vault.common import get_config
+
 
 logger = getLogger(__name__)
 
+config = get_config()
+
+# Upper bound of segments for a single scan. This is what we used to always run with.
+MAX_SEGMENTS = int(config("parallel_scan_max_segments", namespace="cis", default="128"))
+# How much table data (in bytes) a single segment should cover before we add another segment.
+SEGMENT_SIZE_BYTES = int(config("parallel_scan_segment_bytes", namespace="cis", default="4194304"))
+# Size of the worker pool shared by all scans of this process.
+POOL_SIZE = int(config("parallel_scan_workers", namespace="cis", default="32"))
+# How long describe_table statistics are trusted. DynamoDB only refreshes them every ~6 hours anyway.
+TABLE_STATS_TTL = 3600
+
+_executor = None
+_executor_lock = threading.Lock()
+_table_stats = {}
+
+# A page of results for one segment. `last_evaluated_key` is None once the segment has been fully read.
+ScanPage = namedtuple("ScanPage", ["segment", "items", "last_evaluated_key"])
+
+
+def get_executor():
+    """Return the worker pool shared by all the scans of this process, creating it on first use."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                logger.debug("Creating parallel scan worker pool of size: {}".format(POOL_SIZE))
+                _executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="parallel_dynamo")
+    return _executor
+
+
+def segments_for_table(dynamodb_client, table_name, max_segments=MAX_SEGMENTS):
+    """
+    Pick a number of segments suited to the size of the table.
+    Small tables are read in a handful of segments, large ones get up to `max_segments`.
+    """
+    stats = _table_stats.get(table_name)
+    if stats is None or stats["expires"] < time.time():
+        try:
+            table = dynamodb_client.describe_table(TableName=table_name)["Table"]
+            stats = dict(size_bytes=table.get("TableSizeBytes", 0), expires=time.time() + TABLE_STATS_TTL)
+            _table_stats[table_name] = stats
+        except Exception as e:
+            logger.warning("Could not describe table {}, using the maximum of segments: {}".format(table_name, e))
+            return max_segments
+
+    segments = int(math.ceil(stats["size_bytes"] / float(SEGMENT_SIZE_BYTES)))
+    return max(1, min(max_segments, segments))
+
+
+class ParallelScan(object):
+    """
+    Run a segmented scan on the shared worker pool and yield ScanPage results as they come back.
+
+    Usage:
+    ```
+    scanner = ParallelScan(client, "local-identity-vault", dict(FilterExpression="begins_with(id, :id)", ...))
+    for page in scanner:
+        do_something(page.items)
+    ```
+
+    `checkpoints` maps each segment that still has work to do to the key it should resume from (None to start at the
+    beginning of the segment). It is updated while iterating, so that it can be persisted and passed back later on to
+    continue where a scan stopped. Segments that have been fully read are removed from it.
+    """
+
+    def __init__(
+        self,
+        dynamodb_client,
+        table_name,
+        scan_kwargs,
+        total_segments=None,
+        checkpoints=None,
+        max_pages_per_segment=None,
+        max_in_flight=None,
+    ):
+        """
+        @dynamodb_client a low level boto3 dynamodb client
+        @table_name str the table to scan
+        @scan_kwargs dict extra arguments passed to every `scan()` call (FilterExpression, ProjectionExpression...)
+        @total_segments int number of segments. Defaults to a value based on the size of the table.
+        @checkpoints dict of segment: exclusive_start_key to resume from. Defaults to all segments, from the start.
+        @max_pages_per_segment int stop reading a segment after this many pages (None to read it all)
+        @max_in_flight int how many pages of this scan may be requested at once. Defaults to the pool size.
+        """
+        self.dynamodb_client = dynamodb_client
+        self.table_name = table_name
+        self.scan_kwargs = scan_kwargs
+        if total_segments is None:
+            total_segments = segments_for_table(dynamodb_client, table_name)
+        self.total_segments = total_segments
+        if checkpoints is None:
+            checkpoints = {segment: None for segment in range(0, total_segments)}
+        self.checkpoints = checkpoints
+        self.max_pages_per_segment = max_pages_per_segment
+        self.max_in_flight = max_in_flight or POOL_SIZE
+
+    def _scan_page(self, segment, exclusive_start_key):
+        kwargs = dict(self.scan_kwargs, TableName=self.table_name, TotalSegments=self.total_segments, Segment=segment)
+        if exclusive_start_key:
+            kwargs["ExclusiveStartKey"] = exclusive_start_key
+
+        logger.debug("Running parallel scan with kwargs: {}".format(kwargs))
+        response = self.dynamodb_client.scan(**kwargs)
+        return ScanPage(segment, response.get("Items", []), response.get("LastEvaluatedKey"))
+
+    def __iter__(self):
+        executor = get_executor()
+        pending = list(self.checkpoints.keys())
+        pages_read = {}
+        in_flight = set()
+
+        try:
+            while pending or in_flight:
+                while pending and len(in_flight) < self.max_in_flight:
+                    segment = pending.pop(0)
+                    in_flight.add(executor.submit(self._scan_page, segment, self.checkpoints[segment]))
+
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    page = future.result()
+                    pages_read[page.segment] = pages_read.get(page.segment, 0) + 1
+
+                    if page.last_evaluated_key is None:
+                        logger.debug("Segment {} has been fully read.".format(page.segment))
+                        del self.checkpoints[page.segment]
+                    else:
+                        self.checkpoints[page.segment] = page.last_evaluated_key
+                        if self.max_pages_per_segment is None or pages_read[page.segment] < self.max_pages_per_segment:
+                            # Continue this segment before starting new ones so that it finishes early.
+                            pending.insert(0, page.segment)
+                    yield page
+        finally:
+            # The caller stopped iterating early, do not keep the pool busy with pages nobody will read.
+            for future in in_flight:
+                future.cancel()
+
+    def items(self):
+        """Yield the items of the scan, one at a time."""
+        for page in self:
+            for item in page.items:
+                yield item
+
+    @property
+    def done(self):
+        return len(self.checkpoints) == 0
+
+
+def encode_cursor(total_segments, checkpoints):
+    """
+    Turn the position of every unfinished segment of a scan into a compact, opaque and url safe string.
+    Returns None when there is nothing left to scan.
+    """
+    if not checkpoints:
+        return None
+    position = dict(t=total_segments, s={str(segment): key for segment, key in checkpoints.items()})
+    compressed = zlib.compress(json.dumps(position, separators=(",", ":")).encode("utf-8"))
+    return base64.urlsafe_b64encode(compressed).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Reverse of encode_cursor()
+    Returns a tuple (total_segments, checkpoints)
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        position = json.loads(zlib.decompress(base64.urlsafe_b64decode(padded)))
+        return position["t"], {int(segment): key for segment, key in position["s"].items()}
+    except (TypeError, ValueError, KeyError, zlib.error) as e:
+        logger.warning("Could not decode pagination cursor {}: {}".format(cursor, e))
+        raise ValueError("Invalid pagination cursor", cursor)
+
 
-def get_segment(
-    result_queue,
-    thread_id,
+def scan(
     dynamodb_client,
     table_name,
     filter_expression,
     expression_attr,
     projection_expression,
-    exclusive_start_key,
-    total_segments,
+    next_page=None,
+    max_pages_per_segment=None,
 ):
-    scan_kwargs = dict(
-        TableName=table_name, TotalSegments=total_segments, Segment=thread_id, FilterExpression=filter_expression
-    )
+    """
+    Scan the table in parallel and return the matching items
+    @next_page str cursor returned by a previous call, to continue that scan where it stopped
+    @max_pages_per_segment int how many pages to read per segment before returning (None to read everything)
+
+    Returns dict(users=list of items, nextPage=cursor or None when the scan is complete)
+    """
+    scan_kwargs = dict(FilterExpression=filter_expression)
 
     if projection_expression:
         scan_kwargs["ProjectionExpression"] = projection_expression
     else:
         scan_kwargs["ProjectionExpression"] = "id, primary_email, user_uuid, active"
 
-    if exclusive_start_key:
-        scan_kwargs["ExclusiveStartKey"] = exclusive_start_key
-
     if expression_attr:
         scan_kwargs["ExpressionAttributeValues"] = expression_attr
 
-    logger.debug("Running parallel scan with kwargs: {}".format(scan_kwargs))
-    response = dynamodb_client.scan(**scan_kwargs)
-    users = response.get("Items", [])
-    last_evaluated_key = response.get("LastEvaluatedKey")
-
-    while last_evaluated_key is not None:
-        scan_kwargs["ExclusiveStartKey"] = last_evaluated_key
-        response = dynamodb_client.scan(**scan_kwargs)
-        users.extend(response.get("Items", []))
-        last_evaluated_key = response.get("LastEvaluatedKey")
-
-    logger.debug("Running thread_id: {}".format(thread_id))
-    return result_queue.put(dict(users=users, nextPage=last_evaluated_key, segment=thread_id))
-
-
-def scan(
-    dynamodb_client, table_name, filter_expression, expression_attr, projection_expression, exclusive_start_key=None
-):
-    logger.debug("Creating new threads and queue.")
-    result_queue = queue.Queue()
-
-    # The worker pool size should be equal to the max_segments. Ideally we want one segment per worker.
-    pool_size = 128
-    max_segments = 128
-
-    users = []
-    last_evaluated_key = None
-    threads = []
-
-    for thread_id in range(0, pool_size):
-        # What are we passing to each threaded function.
-
-        thread_args = (
-            result_queue,
-            thread_id,
+    if next_page:
+        total_segments, checkpoints = decode_cursor(next_page)
+        scanner = ParallelScan(
             dynamodb_client,
             table_name,
-            filter_expression,
-            expression_attr,
-            projection_expression,
-            exclusive_start_key,
-            max_segments,
+            scan_kwargs,
+            total_segments=total_segments,
+            checkpoints=checkpoints,
+            max_pages_per_segment=max_pages_per_segment,
         )
+    else:
+        scanner = ParallelScan(dynamodb_client, table_name, scan_kwargs, max_pages_per_segment=max_pages_per_segment)
 
-        logger.debug(*thread_args)
-        threads.append(threading.Thread(target=get_segment, args=thread_args))
-        threads[-1].start()
-
-    logger.debug("Waiting for threads to terminate...")
-    for t in threads:
-        t.join()
-
-    logger.debug("Retrieving results from the queue...")
-
-    while not result_queue.empty():
-        logger.debug("Results queue is not empty.")
-        result = result_queue.get()
-        users_additional = result.get("users")
-        users.extend(users_additional)
-        if result.get("segment") == max_segments - 1:
-            logger.debug("This is the last segment.")
-            last_evaluated_key = result.get("nextPage")
-            logger.debug("Last evaluated key in page was: {}".format(last_evaluated_key))
-        result_queue.task_done()
-
-    logger.debug("Results queue is empty.")
-    return dict(users=users, nextPage=last_evaluated_key)
+    users = list(scanner.items())
+    logger.debug("Parallel scan of {} segments returned {} users.".format(scanner.total_segments, len(users)))
+    return dict(users=users, nextPage=encode_cursor(scanner.total_segments, scanner.checkpoints))
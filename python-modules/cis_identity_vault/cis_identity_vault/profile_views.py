@@ -0,0 +1,79 @@
+"""Pre-filtered views of user profiles, stored next to the full profile in the identity vault.
+
+Token scopes of the Person API only ever reduce to a handful of data classification x display level combinations.
+When a profile is written, the writer can render the profile filtered for the most common combinations (a "view") and
+store the serialized result in the `profile_views` map attribute of the vault item (`views` is a reserved word),
+keyed by view_key(). Readers that end up with the same combination can return the stored JSON as is, instead of
+filtering the full profile again. Profiles stored without views (or for other combinations) are still filtered on read.
+"""
+import hashlib
+import json
+
+from cis_profile import filter_profile
+from cis_profile.common import DisplayLevel
+from cis_profile.common import MozillaDataClassification
+
+
+# Most requested combinations: public tokens and the display levels used by dinopark and the SSO dashboard.
+DEFAULT_VIEWS = [
+    (MozillaDataClassification.PUBLIC, [DisplayLevel.PUBLIC]),
+    (MozillaDataClassification.PUBLIC, [DisplayLevel.PUBLIC, DisplayLevel.AUTHENTICATED]),
+    (
+        MozillaDataClassification.PUBLIC,
+        [DisplayLevel.PUBLIC, DisplayLevel.AUTHENTICATED, DisplayLevel.VOUCHED, DisplayLevel.NDAED],
+    ),
+    (
+        MozillaDataClassification.PUBLIC + MozillaDataClassification.MOZILLA_CONFIDENTIAL,
+        [DisplayLevel.PUBLIC, DisplayLevel.AUTHENTICATED, DisplayLevel.VOUCHED, DisplayLevel.NDAED, DisplayLevel.STAFF],
+    ),
+]
+
+
+def view_key(classifications, display_levels):
+    """
+    Stable name of the view for this filter combination. Order and duplicates do not matter.
+    @classifications list of str, or None for no classification filtering
+    @display_levels list of str, or None for no display filtering
+
+    Returns str
+    """
+
+    def normalize(values):
+        if values is None:
+            return "*"
+        return ",".join(sorted(set(str(value) for value in values)))
+
+    combination = "{}|{}".format(normalize(classifications), normalize(display_levels))
+    return hashlib.sha256(combination.encode("utf-8")).hexdigest()[:16]
+
+
+def render_views(profile, views=DEFAULT_VIEWS):
+    """
+    Render the filtered views of a profile
+    @profile dict or JSON str of a user profile
+    @views list of (classifications, display_levels) combinations to render
+
+    Returns a dict of view_key: JSON str of the filtered profile
+    """
+    if isinstance(profile, (str, bytes)):
+        profile = json.loads(profile)
+    return {
+        view_key(classifications, display_levels): json.dumps(
+            filter_profile(profile, classifications=classifications, display_levels=display_levels)
+        )
+        for classifications, display_levels in views
+    }
+
+
+def find_view(vault_item, classifications, display_levels):
+    """
+    @vault_item dict an item of the identity vault, as returned by the find_by_* methods of models.user.Profile
+    @classifications list of str, see view_key()
+    @display_levels list of str, see view_key()
+
+    Returns the stored JSON str of the view, or None if the item has no such view
+    """
+    views = vault_item.get("profile_views")
+    if not views:
+        return None
+    return views.get(view_key(classifications, display_levels))
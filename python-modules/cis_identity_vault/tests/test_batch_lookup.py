@@ -0,0 +1,47 @@
+import boto3
+import os
+from moto import mock_aws
+
+
+@mock_aws
+class TestBatchLookup(object):
+    def setup_method(self, method):
+        os.environ["CIS_ENVIRONMENT"] = "purple"
+        os.environ["CIS_REGION_NAME"] = "us-east-1"
+        os.environ["AWS_DEFAULT_REGION"] = "us-east-1"
+        from cis_identity_vault import vault
+
+        self.vault_client = vault.IdentityVault()
+        self.vault_client.connect()
+        self.vault_client.find_or_create()
+        self.boto_session = boto3.session.Session(region_name="us-east-1")
+        self.dynamodb_client = self.boto_session.client("dynamodb")
+        self.table = self.boto_session.resource("dynamodb").Table("purple-identity-vault")
+
+        with self.table.batch_writer() as batch:
+            for x in range(0, 150):
+                batch.put_item(
+                    Item={
+                        "id": "ad|Mozilla-LDAP|user{}".format(x),
+                        "user_uuid": "uuid{}".format(x),
+                        "primary_email": "user{}@mozilla.com".format(x),
+                        "primary_username": "user{}".format(x),
+                        "sequence_number": "12345678",
+                        "profile": "{}",
+                        "active": True,
+                    }
+                )
+
+    def test_find_by_ids(self):
+        from cis_identity_vault.models import user
+
+        profile = user.Profile(self.table, self.dynamodb_client, transactions=False)
+        ids = ["ad|Mozilla-LDAP|user{}".format(x) for x in range(0, 200)]
+        # Duplicates must not be sent twice in the same BatchGetItem call
+        ids.extend(["ad|Mozilla-LDAP|user1", "ad|Mozilla-LDAP|user149"])
+        found = profile.find_by_ids(ids)
+        assert len(found) == 150
+        assert found["ad|Mozilla-LDAP|user42"]["primary_email"] == "user42@mozilla.com"
+        assert found["ad|Mozilla-LDAP|user42"]["active"] is True
+        assert found["ad|Mozilla-LDAP|user42"] == profile.find_by_id("ad|Mozilla-LDAP|user42")["Items"][0]
+        assert profile.find_by_ids([]) == {}
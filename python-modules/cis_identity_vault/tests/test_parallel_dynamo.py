@@ -0,0 +1,98 @@
+import pytest
+
+from cis_identity_vault import parallel_dynamo
+
+
+class FakeSegmentedClient(object):
+    """Just enough of a dynamodb client to exercise segmented, paginated scans."""
+
+    def __init__(self, number_of_items=100, page_size=7, table_size_bytes=0):
+        self.items = [{"id": {"S": "ad|Mozilla-LDAP|user{}".format(x)}} for x in range(0, number_of_items)]
+        self.page_size = page_size
+        self.table_size_bytes = table_size_bytes
+        self.calls = []
+
+    def describe_table(self, TableName):
+        return {"Table": {"TableName": TableName, "TableSizeBytes": self.table_size_bytes}}
+
+    def scan(self, **kwargs):
+        self.calls.append(kwargs)
+        segment_items = [item for n, item in enumerate(self.items) if n % kwargs["TotalSegments"] == kwargs["Segment"]]
+        start = 0
+        if kwargs.get("ExclusiveStartKey"):
+            start = segment_items.index(kwargs["ExclusiveStartKey"]) + 1
+        page = segment_items[start : start + self.page_size]
+        response = {"Items": page}
+        if start + self.page_size < len(segment_items):
+            response["LastEvaluatedKey"] = page[-1]
+        return response
+
+
+class TestParallelScan(object):
+    def test_scan_returns_every_item_once(self):
+        client = FakeSegmentedClient()
+        scanner = parallel_dynamo.ParallelScan(client, "fake-table", {}, total_segments=8)
+        items = list(scanner.items())
+        assert len(items) == 100
+        assert len(set(i["id"]["S"] for i in items)) == 100
+        assert scanner.done is True
+
+    def test_checkpoints_resume_where_scan_stopped(self):
+        client = FakeSegmentedClient()
+        scanner = parallel_dynamo.ParallelScan(client, "fake-table", {}, total_segments=4, max_pages_per_segment=1)
+        first = list(scanner.items())
+        assert len(first) == 4 * 7
+        assert scanner.done is False
+        assert sorted(scanner.checkpoints.keys()) == [0, 1, 2, 3]
+
+        resumed = parallel_dynamo.ParallelScan(
+            client, "fake-table", {}, total_segments=4, checkpoints=scanner.checkpoints
+        )
+        rest = list(resumed.items())
+        assert resumed.done is True
+        assert len(set(i["id"]["S"] for i in first + rest)) == 100
+
+    def test_segments_follow_table_size(self):
+        small = FakeSegmentedClient(table_size_bytes=1024)
+        assert parallel_dynamo.segments_for_table(small, "small-table") == 1
+        huge = FakeSegmentedClient(table_size_bytes=1024 * parallel_dynamo.SEGMENT_SIZE_BYTES)
+        assert parallel_dynamo.segments_for_table(huge, "huge-table") == parallel_dynamo.MAX_SEGMENTS
+
+    def test_scan_compat(self):
+        client = FakeSegmentedClient(table_size_bytes=3 * parallel_dynamo.SEGMENT_SIZE_BYTES)
+        result = parallel_dynamo.scan(client, "compat-table", "begins_with(id, :id)", {":id": {"S": "ad"}}, None)
+        assert len(result["users"]) == 100
+        assert result["nextPage"] is None
+        assert client.calls[0]["ProjectionExpression"] == "id, primary_email, user_uuid, active"
+        assert client.calls[0]["TotalSegments"] == 3
+
+    def test_cursor_round_trip(self):
+        checkpoints = {0: None, 5: {"id": {"S": "ad|Mozilla-LDAP|user5"}}}
+        cursor = parallel_dynamo.encode_cursor(8, checkpoints)
+        assert "=" not in cursor and "/" not in cursor and "+" not in cursor
+        assert parallel_dynamo.decode_cursor(cursor) == (8, checkpoints)
+        assert parallel_dynamo.encode_cursor(8, {}) is None
+
+    def test_invalid_cursor(self):
+        with pytest.raises(ValueError):
+            parallel_dynamo.decode_cursor("ad|Mozilla-LDAP|user5")
+
+    def test_scan_pages_with_cursor(self):
+        client = FakeSegmentedClient(table_size_bytes=4 * parallel_dynamo.SEGMENT_SIZE_BYTES)
+        seen = []
+        next_page = None
+        calls = 0
+        while True:
+            result = parallel_dynamo.scan(
+                client, "paged-table", "begins_with(id, :id)", None, None, next_page=next_page, max_pages_per_segment=1
+            )
+            calls += 1
+            seen.extend(i["id"]["S"] for i in result["users"])
+            assert len(result["users"]) <= 4 * 7
+            next_page = result["nextPage"]
+            if next_page is None:
+                break
+        # 25 items per segment in pages of 7.
+        assert calls == 4
+        assert len(seen) == 100
+        assert len(set(seen)) == 100
@@ -0,0 +1,78 @@
+import boto3
+import json
+import os
+from cis_profile import FakeUser
+from cis_profile.common import DisplayLevel
+from cis_profile.common import MozillaDataClassification
+from moto import mock_aws
+
+
+@mock_aws
+class TestProfileViews(object):
+    def setup_method(self, method):
+        os.environ["CIS_ENVIRONMENT"] = "purple"
+        os.environ["CIS_REGION_NAME"] = "us-east-1"
+        os.environ["AWS_DEFAULT_REGION"] = "us-east-1"
+        from cis_identity_vault import vault
+
+        self.vault_client = vault.IdentityVault()
+        self.vault_client.connect()
+        self.vault_client.find_or_create()
+        self.boto_session = boto3.session.Session(region_name="us-east-1")
+        self.dynamodb_client = self.boto_session.client("dynamodb")
+        self.table = self.boto_session.resource("dynamodb").Table("purple-identity-vault")
+
+        fake_user = FakeUser()
+        self.user_profile = dict(
+            id=fake_user.user_id.value,
+            user_uuid=fake_user.uuid.value,
+            primary_email=fake_user.primary_email.value,
+            primary_username=fake_user.primary_username.value,
+            sequence_number="1234567890",
+            profile=fake_user.as_json(),
+        )
+
+    def test_view_key(self):
+        from cis_identity_vault.profile_views import view_key
+
+        assert view_key(["PUBLIC"], ["public", None]) == view_key(["PUBLIC", "PUBLIC"], [None, "public"])
+        assert view_key(["PUBLIC"], ["public"]) != view_key(["PUBLIC"], ["public", None])
+        assert view_key(None, ["public"]) != view_key(["PUBLIC"], ["public"])
+
+    def test_views_are_stored_with_the_profile(self):
+        from cis_identity_vault.models import user
+        from cis_identity_vault.profile_views import DEFAULT_VIEWS
+        from cis_identity_vault.profile_views import find_view
+        from cis_profile import filter_profile
+
+        profile = user.Profile(self.table, self.dynamodb_client, transactions=False, views=DEFAULT_VIEWS)
+        profile.create_batch([self.user_profile])
+
+        vault_item = profile.find_by_id(self.user_profile["id"])["Items"][0]
+        assert len(vault_item["profile_views"]) == len(DEFAULT_VIEWS)
+        classifications, display_levels = MozillaDataClassification.PUBLIC, [DisplayLevel.PUBLIC]
+        view = find_view(vault_item, classifications, display_levels)
+        expected = filter_profile(json.loads(self.user_profile["profile"]), classifications, display_levels)
+        assert json.loads(view) == expected
+        assert find_view(vault_item, classifications, [DisplayLevel.PRIVATE]) is None
+
+        # Writers that do not store views drop the ones of the previous version of the profile
+        user.Profile(self.table, self.dynamodb_client, transactions=False).update(self.user_profile)
+        vault_item = profile.find_by_id(self.user_profile["id"])["Items"][0]
+        assert "profile_views" not in vault_item
+        assert find_view(vault_item, classifications, display_levels) is None
+
+    def test_views_with_transactions(self):
+        from cis_identity_vault.models import user
+        from cis_identity_vault.profile_views import DEFAULT_VIEWS
+
+        profile = user.Profile(self.table, self.dynamodb_client, transactions=True, views=DEFAULT_VIEWS)
+        profile.create_batch([self.user_profile])
+        assert len(profile.find_by_id(self.user_profile["id"])["Items"][0]["profile_views"]) == len(DEFAULT_VIEWS)
+
+        self.user_profile["sequence_number"] = "1234567891"
+        profile.update_batch([self.user_profile])
+        assert len(profile.find_by_id(self.user_profile["id"])["Items"][0]["profile_views"]) == len(DEFAULT_VIEWS)
+
+        user.Profile(self.table, self.dynamodb_client, transactions=True).update(self.user_profile)
+        assert "profile_views" not in profile.find_by_id(self.user_profile["id"])["Items"][0]
@@ -2,6 +2,7 @@ import json
 from cis_processor import profile
 from cis_processor.common import get_config
 from cis_identity_vault.models import user
+from cis_identity_vault.profile_views import DEFAULT_VIEWS
 
 
 from logging import getLogger
@@ -66,7 +67,11 @@ class BaseProcessor(object):
 
         if signatures_valid is True and publishers_valid is True:
             vault_data_structure = self._profile_to_vault_structure(self.profiles["new_profile"].as_dict())
-            identity_vault = user.Profile(self.dynamodb_table, self.dynamodb_client, False)
+            if self.config("store_profile_views", namespace="cis", default="false") == "true":
+                views = DEFAULT_VIEWS
+            else:
+                views = None
+            identity_vault = user.Profile(self.dynamodb_table, self.dynamodb_client, False, views=views)
             logger.info(
                 "Tests pass for the integration.  Proceeding to flush to dynamodb for user: {}".format(
                     self.profiles["new_profile"].as_dict()["user_id"]["value"]
@@ -1,4 +1,6 @@
 from cis_profile.profile import User
+from cis_profile.profile import sign_all_users
+from cis_profile.profile import filter_profile
 from cis_profile.common import WellKnown
 from cis_profile.common import DotDict
 from cis_profile.common import MozillaDataClassification
@@ -7,4 +9,15 @@ from cis_profile.common import DisplayLevel
 
 import cis_profile.exceptions
 
-__all__ = [User, FakeUser, DotDict, WellKnown, MozillaDataClassification, DotDict, cis_profile.exceptions, DisplayLevel]
+__all__ = [
+    User,
+    sign_all_users,
+    filter_profile,
+    FakeUser,
+    DotDict,
+    WellKnown,
+    MozillaDataClassification,
+    DotDict,
+    cis_profile.exceptions,
+    DisplayLevel,
+]
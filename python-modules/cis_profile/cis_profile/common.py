@@ -1,6 +1,9 @@
 import json
+import jsonschema
+import jsonschema.exceptions
 import os
 import os.path
+import threading
 import time
 import requests
 import requests.exceptions
@@ -20,6 +23,17 @@ def get_config():
     )
 
 
+DEFAULT_DISCOVERY_URL = "https://auth.mozilla.com/.well-known/mozilla-iam"
+# How long (seconds) well-known documents are cached for, in memory and on disk. See WellKnown
+WELL_KNOWN_CACHE_TTL = int(get_config()("well_known_cache_ttl", namespace="cis", default="900"))
+
+# Process wide cache of the well-known documents: (name, discovery_url, always_use_local_file): (fetched_at, data)
+_well_known_cache = {}
+_well_known_cache_lock = threading.RLock()
+# Compiled schema validators: (discovery_url, always_use_local_file): (schema, validator)
+_schema_validators = {}
+
+
 class DotDict(dict):
     """
     Convert a dict to a fake class/object with attributes, such as:
@@ -109,10 +123,14 @@ class WellKnown(object):
     This object cannot fail to return the schema, but the schema is not garanteed to be up to date in case of network
     issues.
 
-    Tries to get the well-known URL and schema from local cache if the cache has not expired.
+    Tries to get the well-known URL and schema from the process wide memory cache, then from the local disk cache, if
+    they have not expired (`well_known_cache_ttl` setting, 15 minutes by default).
     Else, tries to get the schema from well-known URL and cache it.
     Else, uses a library-builtin copy of schema.
 
+    The memory cache is shared by all WellKnown objects of the process, so creating many of them (one per User) is
+    cheap. Use warm_up() to fill it ahead of time, e.g. when a Lambda function starts.
+
     Return: dict Schema dictionary (can be converted to JSON)
 
     Ex:
@@ -123,29 +141,63 @@ class WellKnown(object):
     """
     _well_known_json = None
 
-    def __init__(self, discovery_url="https://auth.mozilla.com/.well-known/mozilla-iam", always_use_local_file=False):
+    def __init__(self, discovery_url=DEFAULT_DISCOVERY_URL, always_use_local_file=False):
         self._request_cache = "/tmp/cis_request_cache"  # XXX use `get_config` to configure that
-        self._request_cache_ttl = 900
+        self._request_cache_ttl = WELL_KNOWN_CACHE_TTL
         self._schema_json = None
         self.discovery_url = discovery_url
-        self.config = get_config()
         self.always_use_local_file = always_use_local_file
 
+    @property
+    def config(self):
+        return get_config()
+
     def get_publisher_rules(self):
         """
         Public wrapper for _load_rules
         """
-        WellKnown._well_known_json = self.get_well_known()
-        rules_url = WellKnown._well_known_json.get("publishers_rules_uri")
-        return self.__cache_file(self._load_publisher_rules(rules_url), name="publisher_rules")
+
+        def load():
+            rules_url = self.get_well_known().get("publishers_rules_uri")
+            return self._load_publisher_rules(rules_url)
+
+        return self.__cached("publisher_rules", load)
 
     def get_schema(self):
         """
         Public wrapper for _load_well_known()
         """
-        WellKnown._well_known_json = self.get_well_known()
-        schema_url = WellKnown._well_known_json.get("api").get("data/profile_schema")
-        return self.__cache_file(self._load_schema(schema_url, stype="data/profile.schema"), name="schema")
+
+        def load():
+            schema_url = self.get_well_known().get("api").get("data/profile_schema")
+            return self._load_schema(schema_url, stype="data/profile.schema")
+
+        return self.__cached("schema", load)
+
+    def get_schema_validator(self):
+        """
+        Returns a jsonschema validator for the profile schema (see get_schema()). The validator is compiled once and
+        reused for as long as the schema does not change.
+        """
+        schema = self.get_schema()
+        key = (self.discovery_url, self.always_use_local_file)
+        cached = _schema_validators.get(key)
+        if cached is None or cached[0] is not schema:
+            validator_class = jsonschema.validators.validator_for(schema)
+            validator_class.check_schema(schema)
+            cached = (schema, validator_class(schema))
+            _schema_validators[key] = cached
+        return cached[1]
+
+    def validate(self, profile):
+        """
+        Same as `jsonschema.validate(profile, self.get_schema())`, with a reused validator
+        @profile dict a user profile
+        Raises jsonschema.exceptions.ValidationError
+        """
+        error = jsonschema.exceptions.best_match(self.get_schema_validator().iter_errors(profile))
+        if error is not None:
+            raise error
 
     def get_core_schema(self):
         """ Deprecated """
@@ -159,29 +211,75 @@ class WellKnown(object):
         """
         Public wrapper for _load_well_known
         """
-        return self.__cache_file(self._load_well_known(), name="well_known")
+        return self.__cached("well_known", self._load_well_known)
 
-    def __cache_file(self, data, name):
+    def warm_up(self):
         """
-        @data json dict
-        @name str name of the cached file, must be unique per file to cache
-        returns json dict of @data
+        Load the well-known, schema, publisher rules and schema validator into the process wide cache, so that the first
+        profiles handled do not pay for it. Call this when a Lambda function starts (outside of the handler).
         """
-        fpath = self._request_cache + "_" + name
-        if not os.path.isfile(fpath) or (os.stat(fpath).st_mtime > time.time() + self._request_cache_ttl):
-            logger.debug(
-                "Caching file (well-known endpoint) at {} for {} seconds".format(fpath, self._request_cache_ttl)
-            )
-            with open(fpath, "w+") as fd:
-                fd.write(json.dumps(data))
-            logger.debug("File to cache is {} lines long".format(len(data)))
+        self.get_well_known()
+        self.get_publisher_rules()
+        self.get_schema_validator()
+
+    def __cached(self, name, loader):
+        """
+        @name str name of the cached document, must be unique per document to cache
+        @loader function returning the json dict of the document, called when it is not cached or has expired
+        returns json dict of the document
+        """
+        key = (name, self.discovery_url, self.always_use_local_file)
+        cached = _well_known_cache.get(key)
+        if cached is not None and cached[0] + self._request_cache_ttl > time.time():
+            return cached[1]
+
+        with _well_known_cache_lock:
+            # Another thread may have refreshed it while we waited
+            cached = _well_known_cache.get(key)
+            if cached is not None and cached[0] + self._request_cache_ttl > time.time():
+                return cached[1]
+
+            fetched_at, data = self.__read_cache_file(name)
+            if data is None:
+                data = loader()
+                fetched_at = time.time()
+                self.__write_cache_file(name, data)
+            _well_known_cache[key] = (fetched_at, data)
             return data
-        else:
-            logger.debug("Using cached file (well-known endpoint) at {}".format(fpath))
+
+    def __read_cache_file(self, name):
+        """
+        Returns (mtime, json dict) of the disk cache of @name, or (None, None) if there is no fresh disk cache
+        """
+        if self.always_use_local_file:
+            return (None, None)
+        fpath = self._request_cache + "_" + name
+        try:
+            mtime = os.stat(fpath).st_mtime
+            if mtime + self._request_cache_ttl <= time.time():
+                logger.debug("Cached file (well-known endpoint) at {} has expired".format(fpath))
+                return (None, None)
             with open(fpath, "r") as fd:
-                ret = fd.read()
-            logger.debug("Cached file is {} lines long".format(len(ret)))
-            return json.loads(ret)
+                data = json.load(fd)
+        except (OSError, ValueError) as e:
+            logger.debug("No usable cached file (well-known endpoint) at {} ({})".format(fpath, e))
+            return (None, None)
+        logger.debug("Using cached file (well-known endpoint) at {}".format(fpath))
+        return (mtime, data)
+
+    def __write_cache_file(self, name, data):
+        if self.always_use_local_file:
+            return
+        fpath = self._request_cache + "_" + name
+        logger.debug("Caching file (well-known endpoint) at {} for {} seconds".format(fpath, self._request_cache_ttl))
+        try:
+            # Write then rename, so that other processes never read a partial file
+            tmp_fpath = "{}.{}".format(fpath, os.getpid())
+            with open(tmp_fpath, "w+") as fd:
+                fd.write(json.dumps(data))
+            os.replace(tmp_fpath, fpath)
+        except OSError as e:
+            logger.warning("Could not cache file (well-known endpoint) at {} ({})".format(fpath, e))
 
     def _load_publisher_rules(self, rules_url):
         """
@@ -212,19 +310,16 @@ class WellKnown(object):
         Gets the discovery url's data ("well-known")
         Return dict,None the well-known JSON data copy
         """
-        # Memory cache
-        if WellKnown._well_known_json is not None:
-            return WellKnown._well_known_json
-
+        well_known_json = None
         if not self.always_use_local_file:
             try:
                 r = requests.get(self.discovery_url)
-                WellKnown._well_known_json = r.json()
+                well_known_json = r.json()
             except (json.JSONDecodeError, requests.exceptions.ConnectionError) as e:
                 logger.debug("Failed to fetch schema url from discovery {} ({})".format(self.discovery_url, e))
                 logger.debug("Using builtin copy")
 
-        if WellKnown._well_known_json is None or self.always_use_local_file:
+        if well_known_json is None or self.always_use_local_file:
             well_known_file = "data/well-known/mozilla-iam"  # Local fall-back
             if not os.path.isfile(well_known_file):
                 dirname = os.path.dirname(os.path.realpath(__file__))
@@ -232,9 +327,10 @@ class WellKnown(object):
             else:
                 path = well_known_file
             with open(path, "r") as handle:
-                WellKnown._well_known_json = json.load(handle)
+                well_known_json = json.load(handle)
 
-        return WellKnown._well_known_json
+        WellKnown._well_known_json = well_known_json
+        return well_known_json
 
     def _load_schema(self, schema_url, stype="data/profile.schema"):
         """
@@ -264,3 +360,14 @@ class WellKnown(object):
 
             schema = json.load(open(path))
         return schema
+
+
+def warm_up(discovery_url=None):
+    """
+    Fill the process wide well-known/schema cache, see WellKnown.warm_up()
+    @discovery_url str the well-known Mozilla IAM URL. Defaults to the CIS_DISCOVERY_URL environment variable, like
+    cis_profile.User does.
+    """
+    if discovery_url is None:
+        discovery_url = os.environ.get("CIS_DISCOVERY_URL", DEFAULT_DISCOVERY_URL)
+    WellKnown(discovery_url).warm_up()
@@ -1,15 +1,19 @@
 #!/usr/bin/env python
 
 from cis_profile.common import WellKnown
+from cis_profile.common import DEFAULT_DISCOVERY_URL
 from cis_profile.common import DotDict
 from cis_profile.common import MozillaDataClassification
 from cis_profile.common import DisplayLevel
+from cis_profile.common import get_config
 
 import cis_crypto.operation
 import cis_profile.exceptions
 import jose.exceptions
 import json
 import json.decoder
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from uuid import uuid5
 from uuid import NAMESPACE_URL
 from base64 import urlsafe_b64encode
@@ -28,6 +32,33 @@ import time
 
 logger = logging.getLogger(__name__)
 
+# Compiled attribute plans, per profile structure. See User._attribute_plan()
+_attribute_plans = {}
+
+
+class AttributePath(namedtuple("AttributePath", ["parent", "name"])):
+    """
+    Location of a single user profile attribute: either at the top level (parent is None), or in a 2nd level attribute
+    such as `access_information` (parent is "access_information", name is "ldap")
+    """
+
+    __slots__ = ()
+
+    @property
+    def path(self):
+        if self.parent is None:
+            return self.name
+        return "{}.{}".format(self.parent, self.name)
+
+    def lookup(self, profile):
+        """
+        @profile dict a user profile structure (such as User.__dict__)
+        Returns the attribute this path points to
+        """
+        if self.parent is None:
+            return profile[self.name]
+        return profile[self.parent][self.name]
+
 
 class User(object):
     """
@@ -55,7 +86,7 @@ class User(object):
         @kwargs any user profile attribute name to override on initializing, eg "user_id='test'"
         """
         if discovery_url is None:
-            discovery_url = os.environ.get("CIS_DISCOVERY_URL", "https://auth.mozilla.com/.well-known/mozilla-iam")
+            discovery_url = os.environ.get("CIS_DISCOVERY_URL", DEFAULT_DISCOVERY_URL)
         self.__well_known = WellKnown(discovery_url)
 
         if user_structure_json is not None:
@@ -199,24 +230,44 @@ class User(object):
         now = self._get_current_utc_time()
         logger.debug("Setting all profile metadata fields and profile modification timestamps to now: {}".format(now))
 
-        for item in self.__dict__:
-            if type(self.__dict__[item]) is not DotDict:
-                continue
-            if "metadata" in self.__dict__[item]:
-                self.__dict__[item]["metadata"]["created"] = now
-                self.__dict__[item]["metadata"]["last_modified"] = now
-            else:
-                # This is a 2nd level attribute such as `access_information`
-                # Note that we do not have a 3rd level so this is sufficient
-                for subitem in self.__dict__[item]:
-                    if isinstance(self.__dict__[item][subitem], dict) and "metadata" in self.__dict__[item][subitem]:
-                        self.__dict__[item][subitem]["metadata"]["created"] = now
-                        self.__dict__[item][subitem]["metadata"]["last_modified"] = now
+        for path in self._attribute_plan():
+            attr = path.lookup(self.__dict__)
+            attr["metadata"]["created"] = now
+            attr["metadata"]["last_modified"] = now
 
         # XXX Hard-coded special profile values
         self.__dict__["last_modified"].value = now
         self.__dict__["created"].value = now
 
+    def _attribute_plan(self):
+        """
+        Returns the list of AttributePath of every attribute of this user, top level and 2nd level ones alike.
+        The list is compiled once per profile structure and shared by all users with the same structure, so that the
+        walkers (signing, verification, timestamps) do not need to discover the structure again for each profile.
+        """
+        structure = tuple(
+            (item, tuple(attr.keys()) if "metadata" not in attr else None)
+            for item, attr in self.__dict__.items()
+            if type(attr) is DotDict
+        )
+        plan = _attribute_plans.get(structure)
+        if plan is None:
+            plan = []
+            for item, subitems in structure:
+                if subitems is None:
+                    plan.append(AttributePath(None, item))
+                    continue
+                # This is a 2nd level attribute such as `access_information`
+                # Note that we do not have a 3rd level so this is sufficient
+                for subitem in subitems:
+                    attr = self.__dict__[item][subitem]
+                    if isinstance(attr, dict) and "metadata" in attr:
+                        plan.append(AttributePath(item, subitem))
+            plan = tuple(plan)
+            _attribute_plans[structure] = plan
+            logger.debug("Compiled attribute plan of {} attributes for a new profile structure".format(len(plan)))
+        return plan
+
     def update_timestamp(self, req_attr):
         """
         Updates metadata timestamps for that attribute
@@ -346,7 +397,7 @@ class User(object):
         Validates against a JSON schema
         """
 
-        return jsonschema.validate(self.as_dict(), self.__well_known.get_schema())
+        return self.__well_known.validate(self.as_dict())
 
     def verify_all_publishers(self, previous_user):
         """
@@ -359,22 +410,12 @@ class User(object):
 
         Returns True on success, False if validation fails.
         """
-        for item in self.__dict__:
-            if type(self.__dict__[item]) is not DotDict:
-                continue
-            try:
-                attr = self.__dict__[item]
-                ret = self.verify_can_publish(attr, attr_name=item, previous_attribute=previous_user.as_dict()[item])
-            except (AttributeError, KeyError):
-                # This is the 2nd level attribute match, see also initialize_timestamps()
-                for subitem in self.__dict__[item]:
-                    attr = self.__dict__[item][subitem]
-                    ret = self.verify_can_publish(
-                        attr,
-                        attr_name=subitem,
-                        parent_name=item,
-                        previous_attribute=previous_user.as_dict()[item][subitem],
-                    )
+        previous_profile = previous_user.__dict__
+        for path in self._attribute_plan():
+            attr = path.lookup(self.__dict__)
+            ret = self.verify_can_publish(
+                attr, attr_name=path.name, parent_name=path.parent, previous_attribute=path.lookup(previous_profile)
+            )
             if ret is not True:
                 logger.warning("Verification of publisher failed for attribute {}".format(attr))
                 return False
@@ -512,21 +553,11 @@ class User(object):
         """
         Verifies all child nodes with a non-null value's signature against a publisher signature
         """
-        for item in self.__dict__:
-            if type(self.__dict__[item]) is not DotDict:
-                continue
-            try:
-                attr = self.__dict__[item]
-                if self._attribute_value_set(attr):
-                    logger.debug("Verifying attribute {}".format(item))
-                    attr = self._verify_attribute_signature(attr)
-            except KeyError:
-                # This is the 2nd level attribute match, see also initialize_timestamps()
-                for subitem in self.__dict__[item]:
-                    attr = self.__dict__[item][subitem]
-                    if self._attribute_value_set(attr):
-                        logger.debug("Verifying attribute {}.{}".format(item, subitem))
-                        attr = self._verify_attribute_signature(attr)
+        for path in self._attribute_plan():
+            attr = path.lookup(self.__dict__)
+            if self._attribute_value_set(attr):
+                logger.debug("Verifying attribute {}".format(path.path))
+                attr = self._verify_attribute_signature(attr)
             if attr is None:
                 logger.warning("Verification failed for attribute {}".format(attr))
                 return False
@@ -603,42 +634,22 @@ class User(object):
         """
 
         logger.debug("Signing all profile fields that have a value set with publisher {}".format(publisher_name))
-        for item in self.__dict__:
-            if type(self.__dict__[item]) is not DotDict:
-                continue
-            try:
-                attr = self.__dict__[item]
-                if self._attribute_value_set(attr, strict=True):
-                    if attr["signature"]["publisher"]["name"] == publisher_name:
-                        logger.debug("Signing attribute {}".format(item))
-                        attr = self._sign_attribute(attr, publisher_name)
-                    else:
-                        logger.error(
-                            "Attribute has value set but wrong publisher set, cannot sign: {} (publisher: {})".format(
-                                attr, publisher_name
-                            )
+        for path in self._attribute_plan():
+            attr = path.lookup(self.__dict__)
+            if self._attribute_value_set(attr, strict=True):
+                if attr["signature"]["publisher"]["name"] == publisher_name:
+                    logger.debug("Signing attribute {}".format(path.path))
+                    attr = self._sign_attribute(attr, publisher_name)
+                else:
+                    logger.error(
+                        "Attribute has value set but wrong publisher set, cannot sign: {} (publisher: {})".format(
+                            attr, publisher_name
+                        )
+                    )
+                    if safety:
+                        raise cis_profile.exceptions.SignatureRefused(
+                            "Attribute has value set but wrong publisher set, cannot" " sign", attr
                         )
-                        if safety:
-                            raise cis_profile.exceptions.SignatureRefused(
-                                "Attribute has value set but wrong publisher set, cannot" " sign", attr
-                            )
-            except KeyError:
-                # This is the 2nd level attribute match, see also initialize_timestamps()
-                for subitem in self.__dict__[item]:
-                    attr = self.__dict__[item][subitem]
-                    if self._attribute_value_set(attr, strict=True):
-                        if attr["signature"]["publisher"]["name"] == publisher_name:
-                            logger.debug("Signing attribute {}.{}".format(item, subitem))
-                            attr = self._sign_attribute(attr, publisher_name)
-                        else:
-                            logger.error(
-                                "Attribute has value set but wrong publisher set, cannot sign: {} (publisher: "
-                                "{})".format(attr, publisher_name)
-                            )
-                            if safety:
-                                raise cis_profile.exceptions.SignatureRefused(
-                                    "Attribute has value set but wrong publisher set, cannot" " sign", attr
-                                )
 
     def sign_attribute(self, req_attr, publisher_name):
         """
@@ -730,3 +741,97 @@ class User(object):
         for _ in todel:
             logger.debug("Removing attribute {} because it's not in {}".format(_, valid))
             del level[_]
+
+
+def filter_profile(profile, classifications=None, display_levels=None):
+    """
+    Read-only equivalent of User.filter_scopes() followed by User.filter_display() and User.as_dict(), for a plain
+    profile dict (e.g. straight out of `orjson.loads()`). Both filters are applied in a single pass and no User object is
+    created, which makes this suitable for read paths that return many profiles.
+    The passed profile is not modified: the returned dict shares the attributes that are kept with it.
+
+    @profile dict a user profile structure
+    @classifications list of str classifications to retain (see MozillaDataClassification), None for no filtering
+    @display_levels list of str display levels to retain (see DisplayLevel), None for no filtering. To apply several
+    display filters, pass the display levels they have in common.
+
+    Returns the filtered profile dict
+    """
+    if classifications is None and display_levels is None:
+        return profile
+    return _filter_profile_level(profile, classifications, display_levels)
+
+
+def _filter_profile_level(level, classifications, display_levels):
+    filtered = {}
+    for attr, value in level.items():
+        if attr.startswith("_") or not isinstance(value, dict):
+            filtered[attr] = value
+        elif "metadata" not in value:
+            filtered[attr] = _filter_profile_level(value, classifications, display_levels)
+        elif classifications is not None and value["metadata"]["classification"] not in classifications:
+            continue
+        elif display_levels is not None and value["metadata"]["display"] not in display_levels:
+            continue
+        else:
+            filtered[attr] = value
+    return filtered
+
+
+def _sign_all_worker(job):
+    """
+    Process pool side of sign_all_users()
+    @job tuple (profile dict, publisher_name, safety)
+    Returns a dict of attribute path: publisher signature structure
+    """
+    profile, publisher_name, safety = job
+    user = User(user_structure_json=profile)
+    user.sign_all(publisher_name=publisher_name, safety=safety)
+    return {path.path: dict(path.lookup(user.__dict__)["signature"]["publisher"]) for path in user._attribute_plan()}
+
+
+def sign_all_users(users, publisher_name, safety=True, workers=None):
+    """
+    Same as calling User.sign_all() on each of @users, but spreads the work over a pool of processes.
+    Signatures are identical to the ones User.sign_all() produces, and are set in place in each User.
+    If process pools are not available (e.g. in AWS Lambda) the users are signed one after the other.
+
+    @users list of User
+    @publisher_name str a publisher name, see User.sign_all()
+    @safety bool see User.sign_all()
+    @workers int number of processes. Defaults to the `sign_workers` setting, or to the number of CPUs.
+
+    Returns a list with, for each user, None if signing succeeded or the exception signing raised
+    """
+    if workers is None:
+        workers = int(get_config()("sign_workers", namespace="cis", default="0")) or os.cpu_count() or 1
+
+    errors = [None] * len(users)
+    executor = None
+    if workers > 1 and len(users) > 1:
+        try:
+            executor = ProcessPoolExecutor(max_workers=min(workers, len(users)))
+        except (OSError, ImportError, NotImplementedError) as e:
+            logger.warning("Process pool unavailable, signing profiles sequentially: {}".format(e))
+
+    if executor is None:
+        for n, user in enumerate(users):
+            try:
+                user.sign_all(publisher_name=publisher_name, safety=safety)
+            except Exception as e:
+                errors[n] = e
+        return errors
+
+    logger.debug("Signing {} profiles with {} processes".format(len(users), workers))
+    with executor:
+        futures = [executor.submit(_sign_all_worker, (user.as_dict(), publisher_name, safety)) for user in users]
+        for n, future in enumerate(futures):
+            try:
+                signatures = future.result()
+            except Exception as e:
+                errors[n] = e
+                continue
+            for path in users[n]._attribute_plan():
+                if path.path in signatures:
+                    path.lookup(users[n].__dict__)["signature"]["publisher"].update(signatures[path.path])
+    return errors
@@ -67,6 +67,27 @@ class TestProfile(object):
         assert "user_id" not in u.as_dict().keys()
         assert "title" not in u.as_dict()["staff_information"].keys()
 
+    def test_filter_profile(self):
+        u = profile.User(user_id="filtered")
+        u.user_id.metadata.classification = MozillaDataClassification.MOZILLA_CONFIDENTIAL[0]
+        u.staff_information.title.metadata.display = DisplayLevel.STAFF
+        vault_profile = json.loads(u.as_json())
+
+        filtered = profile.filter_profile(
+            vault_profile,
+            classifications=MozillaDataClassification.PUBLIC,
+            display_levels=[DisplayLevel.PUBLIC, DisplayLevel.NULL],
+        )
+        u.filter_scopes(MozillaDataClassification.PUBLIC)
+        u.filter_display([DisplayLevel.PUBLIC, DisplayLevel.NULL])
+        assert filtered == json.loads(u.as_json())
+        assert "user_id" not in filtered
+        assert "title" not in filtered["staff_information"]
+        # The source profile is left alone
+        assert "user_id" in vault_profile
+        assert "title" in vault_profile["staff_information"]
+        assert profile.filter_profile(vault_profile) is vault_profile
+
     def test_profile_override(self):
         u = profile.User(user_id="test")
         assert u.user_id.value == "test"
@@ -134,6 +155,25 @@ class TestProfile(object):
         else:
             raise Exception("ValidationFailure", "Should have failed validation, did not")
 
+    def test_sign_all_users(self):
+        users = [profile.User(user_id="test{}".format(x)) for x in range(0, 3)]
+        users[1].fun_title.value = "test title"
+        users[1].fun_title.signature.publisher.name = "access_provider"
+        users[2].fun_title.value = "test title"
+        users[2].fun_title.signature.publisher.name = "wrong"
+        expected = [profile.User(user_structure_json=copy.deepcopy(u.as_dict())) for u in users[:2]]
+        for u in expected:
+            u.sign_all(publisher_name="access_provider")
+
+        errors = profile.sign_all_users(users, publisher_name="access_provider", workers=2)
+        assert errors[0] is None
+        assert errors[1] is None
+        assert isinstance(errors[2], cis_profile.exceptions.SignatureRefused)
+        # Signatures are deterministic and must match the ones sign_all() produces
+        assert users[0].as_dict() == expected[0].as_dict()
+        assert users[1].as_dict() == expected[1].as_dict()
+        assert users[1].fun_title.signature.publisher.value is not None
+
     def test_single_attribute_signing(self):
         u = profile.User(user_id="test")
         u.sign_attribute("user_id", publisher_name="ldap")
@@ -263,6 +303,23 @@ class TestProfile(object):
         u2.login_method.value = "github"
         assert u2.verify_all_publishers(u) is True
 
+    def test_attribute_plan(self):
+        a = profile.User(user_id="usera")
+        b = profile.User(user_id="userb")
+        plan = a._attribute_plan()
+        # The plan is compiled once and shared by users with the same structure
+        assert plan is b._attribute_plan()
+        paths = [path.path for path in plan]
+        assert "user_id" in paths
+        assert "access_information.ldap" in paths
+        assert "staff_information.title" in paths
+        assert "access_information" not in paths
+        assert "schema" not in paths
+
+        # A different structure gets its own plan
+        del b.access_information["ldap"]
+        assert "access_information.ldap" not in [path.path for path in b._attribute_plan()]
+
     def test_data_classification(self):
         u = profile.User(user_id="test")
         assert u.user_id.metadata.classification in MozillaDataClassification.PUBLIC
@@ -1,6 +1,13 @@
+from cis_profile import common
 from cis_profile.common import WellKnown
 from cis_profile.profile import User
+from unittest import mock
+
+import json
+import jsonschema.exceptions
 import os
+import pytest
+import time
 
 
 class Test_WellKnown(object):
@@ -31,3 +38,45 @@ class Test_WellKnown(object):
         os.environ["CIS_DISCOVERY_URL"] = "https://auth.allizom.org/.well-known/mozilla-iam"
         u = User()
         assert u._User__well_known.discovery_url == "https://auth.allizom.org/.well-known/mozilla-iam"
+
+    def test_memory_cache(self):
+        wk = WellKnown(always_use_local_file=True)
+        data = wk.get_well_known()
+        with mock.patch("cis_profile.common.open", side_effect=AssertionError("disk read")):
+            assert WellKnown(always_use_local_file=True).get_well_known() is data
+            assert User().validate() is None
+
+    def test_expired_cache_is_refreshed(self):
+        wk = WellKnown(always_use_local_file=True)
+        wk.get_schema()
+        key = ("schema", wk.discovery_url, True)
+        fetched_at, schema = common._well_known_cache[key]
+        common._well_known_cache[key] = (time.time() - wk._request_cache_ttl - 1, schema)
+        assert wk.get_schema() is not schema
+        assert common._well_known_cache[key][0] > fetched_at
+
+    def test_disk_cache_ttl(self, tmp_path):
+        wk = WellKnown()
+        wk._request_cache = str(tmp_path / "cis_request_cache")
+        cache_file = tmp_path / "cis_request_cache_test"
+        cache_file.write_text('{"cached": true}')
+        loader = mock.Mock(return_value={"cached": False})
+        assert wk._WellKnown__cached("test", loader) == {"cached": True}
+        assert loader.call_count == 0
+
+        # Expired files are replaced with a fresh copy
+        common._well_known_cache.clear()
+        old = time.time() - wk._request_cache_ttl - 1
+        os.utime(str(cache_file), (old, old))
+        assert wk._WellKnown__cached("test", loader) == {"cached": False}
+        assert loader.call_count == 1
+        assert json.loads(cache_file.read_text()) == {"cached": False}
+
+    def test_schema_validator_is_reused(self):
+        wk = WellKnown(always_use_local_file=True)
+        validator = wk.get_schema_validator()
+        assert WellKnown(always_use_local_file=True).get_schema_validator() is validator
+        u = User()
+        u.user_id.value = {"invalid": "test"}
+        with pytest.raises(jsonschema.exceptions.ValidationError):
+            wk.validate(u.as_dict())
@@ -5,10 +5,7 @@ from flask_restful import Resource
 from flask_restful import reqparse
 
 
-from cis_profile import User
-from cis_profile_retrieval_service.common import DisplayLevelParms
-from cis_profile_retrieval_service.common import scope_to_mozilla_data_classification
-from cis_profile_retrieval_service.common import scope_to_display_level
+from cis_profile_retrieval_service.common import filter_profile_for_scopes
 from cis_profile_retrieval_service.idp import requires_auth
 from cis_profile_retrieval_service.idp import get_scopes
 from cis_identity_vault.models import user
@@ -59,32 +56,10 @@ def filter_full_profiles(scopes, filter_display, vault_profiles):
         else:
             vault_profile = profile.get("profile")
 
-        v2_profile = User(user_structure_json=vault_profile)
-
-        if "read:fullprofile" in scopes:
-            # Assume someone has asked for all the data.
-            logger.debug(
-                "The provided token has access to all of the data.", extra={"scopes": scopes}
-            )
-            pass
-        else:
-            # Assume the we are filtering falls back to public with no scopes
-            logger.debug("This is a limited scoped query.", extra={"scopes": scopes})
-            v2_profile.filter_scopes(scope_to_mozilla_data_classification(scopes))
-
-        if "display:all" in scopes:
-            logger.debug("display:all in token not filtering profile.", extra={"scopes": scopes})
-        else:
-            logger.debug("display filtering engaged for query.", extra={"scopes": scopes})
-            v2_profile.filter_display(scope_to_display_level(scopes))
-
-        if filter_display is not None:
-            v2_profile.filter_display(DisplayLevelParms.map(filter_display))
-
         v2_profiles.append(
             dict(
-                id=v2_profile.user_id,
-                profile=v2_profile.as_dict()
+                id=vault_profile["user_id"],
+                profile=filter_profile_for_scopes(vault_profile, scopes, filter_display)
             )
         )
 
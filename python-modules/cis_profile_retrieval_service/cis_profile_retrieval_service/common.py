@@ -11,8 +11,10 @@ from everett.manager import ConfigOSEnv
 from cis_profile.fake_profile import batch_create_fake_profiles
 from cis_identity_vault.models import user
 from cis_identity_vault.vault import IdentityVault
+from cis_identity_vault.profile_views import find_view
 from cis_profile.common import DisplayLevel
 from cis_profile.common import MozillaDataClassification
+from cis_profile.profile import filter_profile
 
 
 logger = logging.getLogger(__name__)
@@ -206,3 +208,66 @@ class DisplayLevelParms(object):
     @classmethod
     def map(cls, display_level):
         return getattr(cls, display_level, cls.public)
+
+
+def scopes_to_filters(scopes, filter_display=None):
+    """
+    Reduce the token scopes and the `filterDisplay` query argument to the filters they require
+    Returns a tuple (classifications, display_levels), where None means no filtering
+    """
+    if "read:fullprofile" in scopes:
+        classifications = None
+    else:
+        classifications = scope_to_mozilla_data_classification(scopes)
+
+    if "display:all" in scopes:
+        display_levels = None
+    else:
+        display_levels = scope_to_display_level(scopes)
+
+    if filter_display is not None:
+        requested_levels = DisplayLevelParms.map(filter_display)
+        if display_levels is None:
+            display_levels = requested_levels
+        else:
+            display_levels = [level for level in display_levels if level in requested_levels]
+    return classifications, display_levels
+
+
+def filter_profile_for_scopes(profile, scopes, filter_display=None):
+    """
+    Filters a vault profile (plain dict) down to what the token scopes and the `filterDisplay` query argument allow.
+    Same result as User.filter_scopes() and User.filter_display() but without building a User object.
+    """
+    classifications, display_levels = scopes_to_filters(scopes, filter_display)
+    logger.debug(
+        "Filtering profile",
+        extra={"scopes": scopes, "classifications": classifications, "display_levels": display_levels},
+    )
+    return filter_profile(profile, classifications=classifications, display_levels=display_levels)
+
+
+def vault_item_is_active(vault_item):
+    """Returns the `active` value of the profile of an identity vault item"""
+    if "active" in vault_item:
+        return vault_item["active"]
+    return orjson.loads(vault_item["profile"])["active"]["value"]
+
+
+def render_vault_item(vault_item, scopes, filter_display=None):
+    """
+    Returns the JSON (str) of the profile of an identity vault item, filtered for the token scopes and the
+    `filterDisplay` query argument. Stored profiles and pre-filtered views (see cis_identity_vault.profile_views) are
+    returned as is, other combinations are filtered here.
+    """
+    classifications, display_levels = scopes_to_filters(scopes, filter_display)
+    if classifications is None and display_levels is None:
+        return vault_item["profile"]
+
+    view = find_view(vault_item, classifications, display_levels)
+    if view is not None:
+        logger.debug("Returning a stored profile view", extra={"scopes": scopes})
+        return view
+
+    profile = filter_profile(orjson.loads(vault_item["profile"]), classifications, display_levels)
+    return orjson.dumps(profile).decode("utf-8")
@@ -7,21 +7,20 @@ from flask_restful import Api
 from flask_restful import Resource
 from flask_restful import reqparse
 from flask import jsonify
+from flask import Response
 from graphene import Schema
 from logging import getLogger
 import urllib.parse
 
 from cis_identity_vault.models import user
-from cis_profile.profile import User
 from cis_profile_retrieval_service.advanced import v2UsersByAttrContains
 from cis_profile_retrieval_service.common import get_config
 from cis_profile_retrieval_service.common import initialize_vault
 from cis_profile_retrieval_service.common import get_dynamodb_client
 from cis_profile_retrieval_service.common import get_table_resource
 from cis_profile_retrieval_service.common import load_dirty_json
-from cis_profile_retrieval_service.common import DisplayLevelParms
-from cis_profile_retrieval_service.common import scope_to_display_level
-from cis_profile_retrieval_service.common import scope_to_mozilla_data_classification
+from cis_profile_retrieval_service.common import render_vault_item
+from cis_profile_retrieval_service.common import vault_item_is_active
 from cis_profile_retrieval_service.common import seed
 from cis_profile_retrieval_service.schema import Query
 from cis_profile_retrieval_service.schema import AuthorizationMiddleware
@@ -64,6 +63,8 @@ authorization_middleware = AuthorizationMiddleware()
 dynamodb_table = get_table_resource()
 dynamodb_client = get_dynamodb_client()
 transactions = config("transactions", namespace="cis", default="false") == "true"
+# How many pages each segment of the parallel scan reads before /v2/users/id/all hands back a nextPage cursor.
+scan_pages_per_segment = int(config("scan_pages_per_segment", namespace="person_api", default="1"))
 
 
 def graphql_view():
@@ -89,8 +90,7 @@ class v2MetadataByPrimaryEmail(Resource):
         if len(result["Items"]) > 0:
             vault_profile = result["Items"][0]["profile"]
             exists_in_cis = True
-            exists_in_ldap = User(user_structure_json=orjson.loads(vault_profile)) \
-                .as_dict()["access_information"]["ldap"]["values"] is not None
+            exists_in_ldap = orjson.loads(vault_profile)["access_information"]["ldap"]["values"] is not None
 
         return jsonify({
             "exists": {
@@ -171,16 +171,26 @@ class v2UsersByAny(Resource):
         else:
             active = True  # Support returning only active users by default.
 
-        all_users = identity_vault.all_filtered(
-            connection_method=args.get("connectionMethod"), active=active, next_page=next_page
-        )
-
-        while len(all_users["users"]) == 0 and all_users["nextPage"] is not None:
-            # If our result set is zero go get the next page.
+        try:
             all_users = identity_vault.all_filtered(
-                connection_method=args.get("connectionMethod"), active=active, next_page=all_users["nextPage"]
+                connection_method=args.get("connectionMethod"),
+                active=active,
+                next_page=next_page,
+                max_pages_per_segment=scan_pages_per_segment,
             )
 
+            while len(all_users["users"]) == 0 and all_users["nextPage"] is not None:
+                # If our result set is zero go get the next page.
+                all_users = identity_vault.all_filtered(
+                    connection_method=args.get("connectionMethod"),
+                    active=active,
+                    next_page=all_users["nextPage"],
+                    max_pages_per_segment=scan_pages_per_segment,
+                )
+        except ValueError as e:
+            logger.warning("Refusing to get all users with an invalid nextPage: {}".format(e))
+            return dict(error="invalid nextPage"), 400
+
         # Convert vault data to cis-profile-like data format
         all_users_cis = []
         for cuser in all_users["users"]:
@@ -220,33 +230,14 @@ def getUser(id, find_by):
     result = find_by(identity_vault, id)
 
     if len(result["Items"]) > 0:
-        vault_profile = result["Items"][0]["profile"]
-        v2_profile = User(user_structure_json=orjson.loads(vault_profile))
-
-        if v2_profile.active.value == active or active is None:
-            if "read:fullprofile" in scopes:
-                logger.debug(
-                    "read:fullprofile in token not filtering based on scopes.",
-                    extra={"query_args": args, "scopes": scopes},
-                )
-            else:
-                v2_profile.filter_scopes(scope_to_mozilla_data_classification(scopes))
-
-            if "display:all" in scopes:
-                logger.debug(
-                    "display:all in token not filtering profile based on display.",
-                    extra={"query_args": args, "scopes": scopes},
-                )
-            else:
-                v2_profile.filter_display(scope_to_display_level(scopes))
+        vault_item = result["Items"][0]
 
+        if vault_item_is_active(vault_item) == active or active is None:
             if filter_display is not None:
                 logger.debug(
                     "filter_display argument is passed, applying display level filter.", extra={"query_args": args}
                 )
-                v2_profile.filter_display(DisplayLevelParms.map(filter_display))
-
-            return jsonify(v2_profile.as_dict())
+            return Response(render_vault_item(vault_item, scopes, filter_display), mimetype="application/json")
 
     logger.debug("No user was found for the query", extra={"query_args": args, "scopes": scopes})
     return jsonify({})
@@ -298,46 +289,19 @@ class v2Users(Resource):
         else:
             active = True  # Support returning only active users by default.
 
-        for profile in result.get("Items"):
-            vault_profile = orjson.loads(profile.get("profile"))
-            v2_profile = User(user_structure_json=vault_profile)
-
-            # This must be a pre filtering check because mutation is real.
-            if v2_profile.active.value == active:
-                allowed_in_list = True
-            else:
-                allowed_in_list = False
-
-            if "read:fullprofile" in scopes:
-                # Assume someone has asked for all the data.
-                logger.debug(
-                    "The provided token has access to all of the data.", extra={"query_args": args, "scopes": scopes}
-                )
-                pass
-            else:
-                # Assume the we are filtering falls back to public with no scopes
-                logger.debug("This is a limited scoped query.", extra={"query_args": args, "scopes": scopes})
-                v2_profile.filter_scopes(scope_to_mozilla_data_classification(scopes))
-
-            if "display:all" in scopes:
-                logger.debug(
-                    "display:all in token not filtering profile.", extra={"query_args": args, "scopes": scopes}
-                )
-            else:
-                logger.debug("display filtering engaged for query.", extra={"query_args": args, "scopes": scopes})
-                v2_profile.filter_display(scope_to_display_level(scopes))
-
-            if filter_display is not None:
-                v2_profile.filter_display(DisplayLevelParms.map(filter_display))
-
-            if allowed_in_list:
-                v2_profiles.append(v2_profile.as_dict())
-            else:
+        for vault_item in result.get("Items"):
+            # Inactive profiles are skipped before doing any filtering work.
+            if vault_item_is_active(vault_item) != active:
                 logger.debug("Skipping adding this profile to the list of profiles because it is: {}".format(active))
-                pass
+                continue
 
-        response = {"Items": v2_profiles, "nextPage": next_page_token}
-        return jsonify(response)
+            v2_profiles.append(render_vault_item(vault_item, scopes, filter_display))
+
+        # Profiles are already serialized, only the envelope is left to build.
+        response = '{{"Items": [{}], "nextPage": {}}}'.format(
+            ",".join(v2_profiles), orjson.dumps(next_page_token).decode("utf-8")
+        )
+        return Response(response, mimetype="application/json")
 
 
 if config("graphql", namespace="person_api", default="false") == "true":
@@ -413,16 +413,28 @@ class Auth0Publisher:
                             p.identities.github_id_v4.signature.publisher.name = "access_provider"
                             p.update_timestamp("identities.github_id_v4")
 
-            # Sign and verify everything
-            try:
-                p.sign_all(publisher_name="access_provider")
-            except Exception as e:
+            profiles.append(p)
+        logger.info("All profiles in this request were converted to CIS Profiles")
+
+        self._sign_and_verify(profiles)
+        return profiles
+
+    def _sign_and_verify(self, profiles):
+        """
+        Sign all the converted profiles, then check they validate and that our publisher may publish them
+        @profiles list of cis_profile.User, signed in place
+        """
+        # Sign everything at once, this spreads the work over all CPUs
+        errors = cis_profile.sign_all_users(profiles, publisher_name="access_provider")
+        for p, e in zip(profiles, errors):
+            if e is not None:
                 logger.critical(
                     "Profile data signing failed for user {} - skipped signing, verification "
                     "WILL FAIL ({})".format(p.primary_email.value, e)
                 )
                 logger.debug("Profile data {}".format(p.as_dict()))
 
+        for p in profiles:
             try:
                 p.validate()
             except Exception as e:
@@ -442,9 +454,6 @@ class Auth0Publisher:
                 logger.debug("Profile data {}".format(p.as_dict()))
 
             logger.debug("Profile signed and ready to publish for user_id {}".format(p.user_id.value))
-            profiles.append(p)
-        logger.info("All profiles in this request were converted to CIS Profiles")
-        return profiles
 
     def process(self, publisher, user_ids):
         """
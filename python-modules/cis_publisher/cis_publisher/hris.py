@@ -492,14 +492,26 @@ class HRISPublisher:
             )
             p.access_information.hris["values"]["egencia_pos_country"] = hruser.get("EgenciaPOSCountry")
             p.access_information.hris.metadata.last_modified = ts_now
-            try:
-                p.sign_all(publisher_name="hris")
-            except Exception as e:
+            user_array.append(p)
+
+        self._sign_and_verify(user_array)
+        return user_array
+
+    def _sign_and_verify(self, user_array):
+        """
+        Sign the profiles built from the HRIS report in one go, then validate them and verify the hris publisher rules
+        @user_array list of cis_profile.User, signed in place
+        """
+        errors = cis_profile.sign_all_users(user_array, publisher_name="hris")
+        for p, e in zip(user_array, errors):
+            if e is not None:
                 logger.critical(
                     "Profile data signing failed for user {} - skipped signing, verification "
                     "WILL FAIL ({})".format(p.primary_email.value, e)
                 )
                 logger.debug("Profile data {}".format(p.as_dict()))
+
+        for p in user_array:
             try:
                 p.validate()
             except Exception as e:
@@ -519,5 +531,3 @@ class HRISPublisher:
                 logger.debug("Profile data {}".format(p.as_dict()))
 
             logger.info("Processed (signed and verified) HRIS report's user {}".format(p.primary_email.value))
-            user_array.append(p)
-        return user_array